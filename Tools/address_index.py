@@ -0,0 +1,115 @@
+import bisect
+from array import array
+
+class AddressIndex:
+    # Sorted start addresses with their sizes. Symbols may overlap, so a
+    # running maximum of the end addresses is kept to know when to stop
+    # walking backwards. It is recomputed lazily after a change.
+    def __init__(self):
+        self.addresses = array("I")
+        self.sizes = array("I")
+        self.max_ends = array("Q")
+
+    def clear(self):
+        del self.addresses[:]
+        del self.sizes[:]
+        del self.max_ends[:]
+
+    def build(self, addresses, sizes):
+        self.clear()
+
+        if all(addresses[i] < addresses[i + 1] for i in range(len(addresses) - 1)):
+            self.addresses.extend(addresses)
+            self.sizes.extend(sizes)
+            return
+
+        for address, size in sorted(zip(addresses, sizes)):
+            self.addresses.append(address)
+            self.sizes.append(size)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def insert(self, address, size):
+        index = bisect.bisect_left(self.addresses, address)
+
+        assert index == len(self.addresses) or self.addresses[index] != address
+
+        self.addresses.insert(index, address)
+        self.sizes.insert(index, size)
+        self._invalidate(index)
+
+    def set_size(self, address, size):
+        index = self._find(address)
+
+        self.sizes[index] = size
+        self._invalidate(index)
+
+    def _find(self, address):
+        index = bisect.bisect_left(self.addresses, address)
+
+        if index == len(self.addresses) or self.addresses[index] != address:
+            raise KeyError(address)
+
+        return index
+
+    def _invalidate(self, index):
+        if index < len(self.max_ends):
+            del self.max_ends[index:]
+
+    def _update_max_ends(self, index):
+        start = len(self.max_ends)
+
+        if start > index:
+            return
+
+        max_end = self.max_ends[start - 1] if start > 0 else 0
+
+        for i in range(start, index + 1):
+            max_end = max(max_end, self.addresses[i] + self.sizes[i])
+            self.max_ends.append(max_end)
+
+    def find_containing(self, address):
+        # Returns the start of the closest symbol covering the address.
+        # Symbols without a size only cover their own address.
+        index = bisect.bisect_right(self.addresses, address) - 1
+
+        if index < 0:
+            return None
+
+        self._update_max_ends(index)
+
+        while index >= 0:
+            start = self.addresses[index]
+
+            if start == address or address < start + self.sizes[index]:
+                return start
+
+            if index == 0 or self.max_ends[index - 1] <= address:
+                break
+
+            index -= 1
+
+        return None
+
+    def range(self, start, end):
+        first = bisect.bisect_left(self.addresses, start)
+        last = bisect.bisect_left(self.addresses, end)
+
+        return self.addresses[first:last].tolist()
+
+    def next(self, address):
+        index = bisect.bisect_right(self.addresses, address)
+
+        if index == len(self.addresses):
+            return None
+
+        return self.addresses[index]
+
+    def prev(self, address):
+        index = bisect.bisect_left(self.addresses, address)
+
+        if index == 0:
+            return None
+
+        return self.addresses[index - 1]
@@ -2,6 +2,45 @@ from capstone import *
 from capstone.ppc import *
 import struct
 import util
+from array import array
+
+try:
+    import numpy
+    _USE_NUMPY = True
+except ModuleNotFoundError:
+    _USE_NUMPY = False
+
+# Number of bytes given to capstone at a time. Capstone stops at the first
+# instruction it doesn't support, and everything after it has to be passed
+# again, so this bounds how much is copied for every unsupported instruction.
+DISASSEMBLE_CHUNK_SIZE = 0x1000
+
+# Branch kinds returned by decode_branch and find_branches
+BRANCH_B = 1 # b, ba
+BRANCH_BL = 2 # bl, bla
+BRANCH_BC = 3 # Conditional branches with a displacement, like beq and bdnz
+BRANCH_BLR = 4 # Only blr itself, see find_branches
+
+BLR = 0x4E800020
+
+# Branch instructions by how get_branch_address finds their target. This
+# might not be correct, it is based on instructions found in SMG2.
+BRANCH_TYPE1_IDS = {
+    PPC_INS_BCLR, PPC_INS_BCTR, PPC_INS_BCTRL,
+    PPC_INS_BLR, PPC_INS_BLRL
+}
+
+BRANCH_TYPE2_IDS = {
+    PPC_INS_B, PPC_INS_BA, PPC_INS_BCCTR, PPC_INS_BCL,
+    PPC_INS_BCLRL,
+    PPC_INS_BDNZ, PPC_INS_BDNZA, PPC_INS_BDNZL, PPC_INS_BDNZLA, PPC_INS_BDNZLR, PPC_INS_BDNZLRL,
+    PPC_INS_BDZ, PPC_INS_BDZA, PPC_INS_BDZL, PPC_INS_BDZLA, PPC_INS_BDZLR, PPC_INS_BDZLRL,
+    PPC_INS_BL, PPC_INS_BLA
+}
+
+BRANCH_TYPE3_IDS = {
+    PPC_INS_BC
+}
 
 def create_cs_obj():
     cs = Cs(CS_ARCH_PPC, CS_MODE_32 | CS_MODE_BIG_ENDIAN)
@@ -10,70 +49,249 @@ def create_cs_obj():
 
     return cs
 
+# Gekko instructions capstone doesn't know. Capstone returns nothing for
+# most of them, and decodes the paired single instructions (opcode 4) as
+# AltiVec. Entries are (primary opcode, extended opcode, mnemonic, format).
+GEKKO_INSTRUCTIONS = [
+    (4, 0, "ps_cmpu0", "crf_a_b"),
+    (4, 32, "ps_cmpo0", "crf_a_b"),
+    (4, 64, "ps_cmpu1", "crf_a_b"),
+    (4, 96, "ps_cmpo1", "crf_a_b"),
+    (4, 40, "ps_neg", "d_b"),
+    (4, 72, "ps_mr", "d_b"),
+    (4, 136, "ps_nabs", "d_b"),
+    (4, 264, "ps_abs", "d_b"),
+    (4, 528, "ps_merge00", "d_a_b"),
+    (4, 560, "ps_merge01", "d_a_b"),
+    (4, 592, "ps_merge10", "d_a_b"),
+    (4, 624, "ps_merge11", "d_a_b"),
+    (4, 1014, "dcbz_l", "ra_rb"),
+    (4, 6, "psq_lx", "psq_x"),
+    (4, 7, "psq_stx", "psq_x"),
+    (4, 38, "psq_lux", "psq_x"),
+    (4, 39, "psq_stux", "psq_x"),
+    (4, 10, "ps_sum0", "d_a_c_b"),
+    (4, 11, "ps_sum1", "d_a_c_b"),
+    (4, 12, "ps_muls0", "d_a_c"),
+    (4, 13, "ps_muls1", "d_a_c"),
+    (4, 14, "ps_madds0", "d_a_c_b"),
+    (4, 15, "ps_madds1", "d_a_c_b"),
+    (4, 18, "ps_div", "d_a_b"),
+    (4, 20, "ps_sub", "d_a_b"),
+    (4, 21, "ps_add", "d_a_b"),
+    (4, 23, "ps_sel", "d_a_c_b"),
+    (4, 24, "ps_res", "d_b"),
+    (4, 25, "ps_mul", "d_a_c"),
+    (4, 26, "ps_rsqrte", "d_b"),
+    (4, 28, "ps_msub", "d_a_c_b"),
+    (4, 29, "ps_madd", "d_a_c_b"),
+    (4, 30, "ps_nmsub", "d_a_c_b"),
+    (4, 31, "ps_nmadd", "d_a_c_b"),
+    (56, None, "psq_l", "psq"),
+    (57, None, "psq_lu", "psq"),
+    (60, None, "psq_st", "psq"),
+    (61, None, "psq_stu", "psq"),
+    (63, 32, "fcmpo", "crf_a_b")
+]
+
+# Extended opcode masks to try for each primary opcode, from the widest.
+# The X form opcodes use 10 bits, psq_*x 6 bits and the A form 5 bits.
+GEKKO_EXTENDED_MASKS = {
+    4: (0x3FF, 0x3F, 0x1F),
+    56: (None,),
+    57: (None,),
+    60: (None,),
+    61: (None,),
+    63: (0x3FF,)
+}
+
+# Ids of the Gekko instructions, after the capstone ones
+GEKKO_INS_BASE = 0x8000
+GEKKO_IDS = { entry[2]: GEKKO_INS_BASE + i for i, entry in enumerate(GEKKO_INSTRUCTIONS) }
+
+GEKKO_TABLE = {
+    (primary, extended): (GEKKO_INS_BASE + i, mnemonic, format)
+    for i, (primary, extended, mnemonic, format) in enumerate(GEKKO_INSTRUCTIONS)
+}
+
+# Formats where the last bit is Rc and adds a . to the mnemonic
+GEKKO_RC_FORMATS = { "d_b", "d_a_b", "d_a_c", "d_a_c_b" }
+
+class GekkoInstruction:
+    # The parts of a capstone instruction the tools use
+    __slots__ = ("id", "address", "raw", "mnemonic", "op_str")
+
+    def __init__(self, id, address, raw, mnemonic, op_str):
+        self.id = id
+        self.address = address
+        self.raw = raw
+        self.mnemonic = mnemonic
+        self.op_str = op_str
+
+    @property
+    def size(self):
+        return 4
+
+    @property
+    def bytes(self):
+        return struct.pack(">I", self.raw)
+
+def is_gekko_instruction(raw):
+    # Whether the instruction is sent to decode_gekko instead of capstone
+    primary = raw >> 26
+
+    if primary == 63:
+        return ((raw >> 1) & 0x3FF) == 32
+
+    return primary in GEKKO_EXTENDED_MASKS
+
+def get_gekko_operands(raw, format):
+    d = (raw >> 21) & 0x1F
+    a = (raw >> 16) & 0x1F
+    b = (raw >> 11) & 0x1F
+    c = (raw >> 6) & 0x1F
+
+    if format == "psq":
+        disp = raw & 0xFFF
+
+        if disp & 0x800:
+            disp -= 0x1000
+
+        return f"f{d}, {disp}(r{a}), {(raw >> 15) & 1}, {(raw >> 12) & 7}"
+
+    if format == "psq_x":
+        return f"f{d}, r{a}, r{b}, {(raw >> 10) & 1}, {(raw >> 7) & 7}"
+
+    if format == "crf_a_b":
+        return f"cr{d >> 2}, f{a}, f{b}"
+
+    if format == "ra_rb":
+        return f"r{a}, r{b}"
+
+    if format == "d_b":
+        return f"f{d}, f{b}"
+
+    if format == "d_a_b":
+        return f"f{d}, f{a}, f{b}"
+
+    if format == "d_a_c":
+        return f"f{d}, f{a}, f{c}"
+
+    return f"f{d}, f{a}, f{c}, f{b}"
+
+def decode_gekko(raw, address):
+    # Table driven decoder for GEKKO_INSTRUCTIONS. Returns None for anything
+    # else, including invalid paired single instructions.
+    primary = raw >> 26
+
+    for mask in GEKKO_EXTENDED_MASKS.get(primary, ()):
+        entry = GEKKO_TABLE.get((primary, (raw >> 1) & mask if mask is not None else None))
+
+        if entry is not None:
+            id, mnemonic, format = entry
+
+            if format in GEKKO_RC_FORMATS and (raw & 1) != 0:
+                mnemonic += "."
+
+            return GekkoInstruction(id, address, raw, mnemonic, get_gekko_operands(raw, format))
+
+    return None
+
+def _disassemble_range(cs, data, offset, end):
+    # Yields the offset and instruction of every instruction capstone should
+    # support, with None for the ones it doesn't. Capstone stops at the first
+    # instruction it doesn't support, so it is called again after it.
+    while offset < end:
+        chunk_end = min(offset + DISASSEMBLE_CHUNK_SIZE, end)
+
+        for instr in cs.disasm(bytes(data[offset:chunk_end]), offset):
+            yield offset, instr
+            offset += 4
+
+        if offset < chunk_end:
+            yield offset, None
+            offset += 4
+
+def _disassemble(cs, data, raws):
+    # Gekko instructions are decoded by decode_gekko and everything between
+    # them by capstone, in as few calls as possible
+    offset = 0
+
+    for i, raw in enumerate(raws):
+        if is_gekko_instruction(raw):
+            yield from _disassemble_range(cs, data, offset, i * 4)
+            yield i * 4, decode_gekko(raw, i * 4)
+            offset = i * 4 + 4
+
+    yield from _disassemble_range(cs, data, offset, len(raws) * 4)
+
 def disassemble_code(cs, data):
-    # Capstone doesn't support some instructions such as psq_l and fcmpo
-    # Therefore we disassemle one instruction at a time, and use the raw
-    # instruction value if it's not supported
-    instructions = []
+    # Returns (instruction, raw instruction value) pairs. The instruction is
+    # a GekkoInstruction for the Gekko specific instructions, and None for
+    # invalid ones. Instruction addresses are offsets into data.
+    raws = struct.unpack(f">{len(data) // 4}I", data[:len(data) // 4 * 4])
 
-    for i in range(0, len(data), 4):
-        instr_data = data[i:i + 4]
-        instruction = list(cs.disasm(instr_data, 0))
+    return [(instr, raws[offset // 4]) for offset, instr in _disassemble(cs, data, raws)]
 
-        raw = (instr_data[0] << 24) | (instr_data[1] << 16) | (instr_data[2] << 8) | instr_data[3]
+def decode_branch(raw, address):
+    # Decodes a b, bl or bc from the raw instruction without capstone.
+    # Returns the branch kind and target, or (None, None) for anything else.
+    opcode = raw >> 26
 
-        if len(instruction) == 0:
-            instr = None
-        elif len(instruction) == 1:
-            instr = instruction[0]
-        else:
-            assert False
+    if opcode == 18:
+        disp = raw & 0x03FFFFFC
+
+        if disp & 0x02000000:
+            disp -= 0x04000000
+
+        target = disp if raw & 2 else address + disp
+
+        return (BRANCH_BL if raw & 1 else BRANCH_B), target
+
+    if opcode == 16:
+        disp = raw & 0xFFFC
+
+        if disp & 0x8000:
+            disp -= 0x10000
+
+        target = disp if raw & 2 else address + disp
 
-        instructions.append((instr, raw))
+        return BRANCH_BC, target
 
-    return instructions
+    return None, None
 
 def is_branch_instruction(instr):
-    return instr.id >= PPC_INS_B and instr.id <= PPC_INS_BLRL;
+    return is_branch_id(instr.id)
 
-def get_branch_address(instr, rel_address):
-    # This whole function might not be correct,
-    # it is based on instructions found in SMG2.
-    type1 = {
-        PPC_INS_BCLR, PPC_INS_BCTR, PPC_INS_BCTRL,
-        PPC_INS_BLR, PPC_INS_BLRL
-    }
-
-    type2 = {
-        PPC_INS_B, PPC_INS_BA, PPC_INS_BCCTR, PPC_INS_BCL,
-        PPC_INS_BCLRL,
-        PPC_INS_BDNZ, PPC_INS_BDNZA, PPC_INS_BDNZL, PPC_INS_BDNZLA, PPC_INS_BDNZLR, PPC_INS_BDNZLRL,
-        PPC_INS_BDZ, PPC_INS_BDZA, PPC_INS_BDZL, PPC_INS_BDZLA, PPC_INS_BDZLR, PPC_INS_BDZLRL,
-        PPC_INS_BL, PPC_INS_BLA
-    }
-
-    type3 = {
-        PPC_INS_BC
-    }
+def is_branch_id(instr_id):
+    return instr_id >= PPC_INS_B and instr_id <= PPC_INS_BLRL
 
+def get_branch_address(instr, rel_address):
     def get(index):
         disp, = struct.unpack('>i', bytes.fromhex(util.hex32(instr.operands[index].mem.base)))
 
+        # Relative displacements include the address the instruction was
+        # disassembled at
+        raw = int.from_bytes(instr.bytes, "big")
+
+        if (raw >> 26) in { 16, 18 } and (raw & 2) == 0:
+            disp -= instr.address
+
         return disp
 
     disp_address = None
 
-    if instr.id in type1:
+    if instr.id in BRANCH_TYPE1_IDS:
         assert len(instr.operands) in { 0, 1 }
 
         return None
 
-    if instr.id in type2:
+    if instr.id in BRANCH_TYPE2_IDS:
         assert len(instr.operands) == 1
         
         disp_address = get(0)
 
-    if instr.id in type3:
+    if instr.id in BRANCH_TYPE3_IDS:
         assert len(instr.operands) in { 1, 2 }
         
         disp_address = get(-1)
@@ -82,3 +300,50 @@ def get_branch_address(instr, rel_address):
         return None
         
     return rel_address + disp_address
+
+def find_branches(data, address):
+    # Decodes every b, bl and bc in a section at once, with data starting at
+    # address. Returns arrays of the source addresses, targets and kinds.
+    # Each blr is included with kind BRANCH_BLR and a target of 0 so that the
+    # end of functions can be found from the same arrays.
+    if not _USE_NUMPY:
+        return _find_branches_slow(data, address)
+
+    words = numpy.frombuffer(data, dtype=">u4", count=len(data) // 4)
+    opcodes = words >> 26
+    indices = numpy.flatnonzero((opcodes == 18) | (opcodes == 16) | (words == BLR))
+
+    raws = words[indices].astype(numpy.int64)
+    is_b = (raws >> 26) == 18
+
+    disp = numpy.where(is_b, raws & 0x03FFFFFC, raws & 0xFFFC)
+    sign = numpy.where(is_b, 0x02000000, 0x8000)
+    disp = numpy.where((disp & sign) != 0, disp - sign * 2, disp)
+
+    sources = address + indices.astype(numpy.int64) * 4
+    targets = numpy.where((raws & 2) != 0, disp, sources + disp) & 0xFFFFFFFF
+
+    kinds = numpy.where(is_b, numpy.where((raws & 1) != 0, BRANCH_BL, BRANCH_B), BRANCH_BC)
+    kinds = numpy.where(raws == BLR, BRANCH_BLR, kinds)
+    targets = numpy.where(raws == BLR, 0, targets)
+
+    return sources.astype(numpy.uint32), targets.astype(numpy.uint32), kinds.astype(numpy.uint8)
+
+def _find_branches_slow(data, address):
+    sources = array("I")
+    targets = array("I")
+    kinds = array("B")
+
+    for i, raw in enumerate(struct.unpack(f">{len(data) // 4}I", data[:len(data) // 4 * 4])):
+        if raw == BLR:
+            kind, target = BRANCH_BLR, 0
+        elif (raw >> 26) in { 16, 18 }:
+            kind, target = decode_branch(raw, address + i * 4)
+        else:
+            continue
+
+        sources.append(address + i * 4)
+        targets.append(target & 0xFFFFFFFF)
+        kinds.append(kind)
+
+    return sources, targets, kinds
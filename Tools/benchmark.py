@@ -0,0 +1,597 @@
+import asm
+import db
+import demangler
+import disasm_cache
+import dol
+import padding_index
+import struct
+import sys
+import time
+import tracemalloc
+import util
+
+GOLDEN_FILE_NAME = util.ROOT_PATH / "Symbols" / "v1.1" / "USA" / "DemangleGolden.txt"
+
+# Bytes of .text disassembled at a time by the disasm benchmark
+BENCH_DISASM_BLOCK_SIZE = 0x10000
+
+def print_help_and_exit():
+    print("Usage: benchmark.py <benchmark> [addition flags]")
+    print()
+
+    print("To benchmark loading the symbol database, use:")
+    print("benchmark.py db-load [<iterations>]")
+    print()
+
+    print("To benchmark demangling every symbol in the symbol database, use:")
+    print("benchmark.py demangle [<iterations>]")
+    print()
+
+    print("To check every symbol against the golden demangled output and measure it, use:")
+    print("benchmark.py demangle-golden [--update]")
+    print()
+
+    print("To benchmark disassembling the .text section of main.dol, use:")
+    print("benchmark.py disasm [<dol>]")
+    print()
+
+    print("To benchmark finding the branches of every function in main.dol, use:")
+    print("benchmark.py discovery [<dol>]")
+    print()
+
+    print("To benchmark decoding every branch in .text with and without NumPy, use:")
+    print("benchmark.py branches [<dol>]")
+    print()
+
+    print("To benchmark decoding the branches of .text with a cold and a warm disassembly cache, use:")
+    print("benchmark.py disasm-cache [<dol>]")
+    print()
+
+    print("To benchmark finding the size of and reading every function in .text, use:")
+    print("benchmark.py words [<dol>]")
+    print()
+
+    sys.exit()
+
+def measure(func, iterations):
+    times = []
+
+    for i in range(iterations):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+
+    return times[0], times[len(times) // 2]
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.1f} ms"
+
+def bench_db_load(args):
+    if len(args) > 1:
+        print_help_and_exit()
+
+    iterations = int(args[0]) if len(args) > 0 else 10
+
+    def load_csv():
+        sym_db = db.SymbolDB()
+        sym_db.use_cache = False
+        sym_db.load()
+
+    def load_cache():
+        sym_db = db.SymbolDB()
+        sym_db.load()
+
+    # Make sure the cache is fresh before timing it
+    load_cache()
+
+    csv_best, csv_median = measure(load_csv, iterations)
+    cache_best, cache_median = measure(load_cache, iterations)
+
+    rows = [
+        ("CSV", format_ms(csv_best), format_ms(csv_median)),
+        ("Cache", format_ms(cache_best), format_ms(cache_median))
+    ]
+
+    util.print_table(("Path", "Best", "Median"), rows)
+
+    print()
+    print(f"Speedup: {csv_median / cache_median:.2f}x")
+
+def get_symbol_names():
+    sym_db = db.SymbolDB()
+    sym_db.load()
+
+    return [name for name in sym_db.names if name]
+
+def bench_demangle(args):
+    if len(args) > 1:
+        print_help_and_exit()
+
+    iterations = int(args[0]) if len(args) > 0 else 5
+
+    names = get_symbol_names()
+
+    def demangle_all():
+        # Each run starts cold, like a new process
+        demangler.clear_caches()
+
+        for name in names:
+            try:
+                demangler.demangle_symbol(name)
+            except demangler.DemanglerException:
+                pass
+
+    best, median = measure(demangle_all, iterations)
+
+    rows = [
+        ("Names", len(names)),
+        ("Best", format_ms(best)),
+        ("Median", format_ms(median)),
+        ("Names/sec", f"{len(names) / median:.0f}")
+    ]
+
+    util.print_table(("Demangle", "Value"), rows)
+
+    cache_rows = []
+
+    for name, info in demangler.get_cache_stats().items():
+        lookups = info.hits + info.misses
+        hit_rate = info.hits / lookups * 100 if lookups > 0 else 0.0
+
+        cache_rows.append((name, info.currsize, info.hits, info.misses, f"{hit_rate:.1f}%"))
+
+    print()
+    util.print_table(("Fragment cache", "Entries", "Hits", "Misses", "Hit rate"), cache_rows)
+
+def get_unique_symbol_names():
+    return list(dict.fromkeys(get_symbol_names()))
+
+def demangle_or_error(name):
+    try:
+        return demangler.demangle_symbol(name)
+    except Exception as e:
+        return f"!{type(e).__name__}"
+
+def read_golden():
+    golden = dict()
+
+    with open(GOLDEN_FILE_NAME, "r") as input:
+        for line in input:
+            name, demangled = line.rstrip("\n").split("\t")
+            golden[name] = demangled
+
+    return golden
+
+def write_golden(names):
+    with open(GOLDEN_FILE_NAME, "w") as output:
+        for name in names:
+            output.write(f"{name}\t{demangle_or_error(name)}\n")
+
+def get_percentile(sorted_values, percentile):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))
+
+    return sorted_values[index]
+
+def bench_demangle_golden(args):
+    # Failures are stored as !<exception name> in the golden file
+    if len(args) > 1 or (len(args) == 1 and args[0] != "--update"):
+        print_help_and_exit()
+
+    names = get_unique_symbol_names()
+
+    if len(args) == 1:
+        write_golden(names)
+        print(f"Wrote {len(names)} name(s) to {GOLDEN_FILE_NAME}.")
+        return
+
+    golden = read_golden()
+
+    demangler.clear_caches()
+
+    latencies = []
+    mismatches = []
+    missing = 0
+
+    total_start = time.perf_counter_ns()
+
+    for name in names:
+        start = time.perf_counter_ns()
+        demangled = demangle_or_error(name)
+        latencies.append(time.perf_counter_ns() - start)
+
+        expected = golden.get(name)
+
+        if expected is None:
+            missing += 1
+        elif demangled != expected:
+            mismatches.append((name, expected, demangled))
+
+    total = (time.perf_counter_ns() - total_start) / 1e9
+
+    # Measured separately since tracing slows down the demangler
+    demangler.clear_caches()
+    tracemalloc.start()
+
+    for name in names:
+        demangle_or_error(name)
+
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+
+    rows = [
+        ("Names", len(names)),
+        ("Mismatches", len(mismatches)),
+        ("Not in golden file", missing),
+        ("Names/sec", f"{len(names) / total:.0f}"),
+        ("p50 latency", f"{get_percentile(latencies, 50) / 1000:.1f} us"),
+        ("p99 latency", f"{get_percentile(latencies, 99) / 1000:.1f} us"),
+        ("Peak memory", f"{peak_memory / 1024:.0f} KiB")
+    ]
+
+    util.print_table(("Demangle golden", "Value"), rows)
+
+    if len(mismatches) > 0:
+        print()
+        util.print_table(("Name", "Expected", "Actual"), mismatches)
+
+        sys.exit(1)
+
+def read_text_section(file_name):
+    with dol.Dol(file_name) as main_dol:
+        return main_dol.get_view(main_dol.get_section(".text1")).tobytes()
+
+def disassemble_code_per_word(cs, data):
+    # The previous implementation, one capstone call per instruction
+    instructions = []
+
+    for i in range(0, len(data), 4):
+        instr_data = data[i:i + 4]
+        instruction = list(cs.disasm(instr_data, 0))
+        raw, = struct.unpack(">I", instr_data)
+
+        instructions.append((instruction[0] if len(instruction) == 1 else None, raw))
+
+    return instructions
+
+def bench_disasm(args):
+    # The sections are compared block by block, since keeping every
+    # capstone instruction of a real .text takes gigabytes. Only the ids are
+    # compared, so capstone doesn't need to produce operand details.
+    if len(args) > 1:
+        print_help_and_exit()
+
+    file_name = args[0] if len(args) > 0 else dol.DOL_FILE_NAME
+    data = read_text_section(file_name)
+
+    cs = asm.create_cs_obj()
+    cs.detail = False
+
+    # The per-word path doesn't know the Gekko instructions
+    def get_ids(instructions):
+        return [(instr.id if instr is not None else None, raw) for instr, raw in instructions if not asm.is_gekko_instruction(raw)]
+
+    per_word_time = 0
+    chunked_time = 0
+    is_same = True
+    gekko = 0
+    unsupported = 0
+
+    for offset in range(0, len(data), BENCH_DISASM_BLOCK_SIZE):
+        block = data[offset:offset + BENCH_DISASM_BLOCK_SIZE]
+
+        start = time.perf_counter()
+        per_word = disassemble_code_per_word(cs, block)
+        per_word_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunked = asm.disassemble_code(cs, block)
+        chunked_time += time.perf_counter() - start
+
+        is_same = is_same and get_ids(per_word) == get_ids(chunked)
+        gekko += sum(1 for instr, _ in chunked if isinstance(instr, asm.GekkoInstruction))
+        unsupported += sum(1 for instr, _ in chunked if instr is None)
+
+    rows = [
+        ("Instructions", len(data) // 4),
+        ("Gekko", gekko),
+        ("Unsupported", unsupported),
+        ("Per-word", format_ms(per_word_time)),
+        ("Chunked", format_ms(chunked_time)),
+        ("Speedup", f"{per_word_time / chunked_time:.2f}x"),
+        ("Same result", is_same)
+    ]
+
+    util.print_table(("Disassemble .text", "Value"), rows)
+
+def get_padded_ranges(data):
+    # Splits the code at the zero padding, like the function discovery does
+    ranges = []
+    start = None
+
+    for offset in range(0, len(data) - 3, 4):
+        is_padding = data[offset:offset + 4] == b"\0\0\0\0"
+
+        if start is None and not is_padding:
+            start = offset
+        elif start is not None and is_padding:
+            ranges.append((start, offset))
+            start = None
+
+    if start is not None:
+        ranges.append((start, len(data) // 4 * 4))
+
+    return ranges
+
+# The passes return (address, raw instruction, target) for every branch
+# with a target
+
+def add_branch(branches, instr, raw, address):
+    if instr is not None and asm.is_branch_instruction(instr):
+        target = asm.get_branch_address(instr, address)
+
+        if target is not None:
+            branches.append((address, raw, target & 0xFFFFFFFF))
+
+def find_branches_per_word(cs, data, ranges):
+    branches = []
+
+    for start, end in ranges:
+        for i, (instr, raw) in enumerate(disassemble_code_per_word(cs, data[start:end])):
+            add_branch(branches, instr, raw, start + i * 4)
+
+    return branches
+
+def find_branches_detail(cs, data, ranges):
+    branches = []
+
+    for start, end in ranges:
+        for instr, raw in asm.disassemble_code(cs, data[start:end]):
+            add_branch(branches, instr, raw, start + instr.address if instr is not None else None)
+
+    return branches
+
+def find_branches_decoded(data, ranges):
+    # What discovery.py does, without capstone
+    branches = []
+
+    for start, end in ranges:
+        sources, targets, kinds = asm.find_branches(data[start:end], start)
+
+        for source, target, kind in zip(sources.tolist(), targets.tolist(), kinds.tolist()):
+            if kind != asm.BRANCH_BLR:
+                raw, = struct.unpack_from(">I", data, source)
+                branches.append((source, raw, target))
+
+    return branches
+
+def bench_discovery(args):
+    if len(args) > 1:
+        print_help_and_exit()
+
+    file_name = args[0] if len(args) > 0 else dol.DOL_FILE_NAME
+    data = read_text_section(file_name)
+    ranges = get_padded_ranges(data)
+
+    results = dict()
+
+    def run(name, func, cs):
+        start = time.perf_counter()
+        results[name] = func(cs, data, ranges)
+        return time.perf_counter() - start
+
+    per_word_time = run("per-word", find_branches_per_word, asm.create_cs_obj())
+    detail_time = run("detail", find_branches_detail, asm.create_cs_obj())
+    decoded_time = run("decoded", lambda cs, data, ranges: find_branches_decoded(data, ranges), None)
+
+    # The old per-word path gives wrong targets for absolute branches, so
+    # only relative ones are compared. Capstone doesn't report the target
+    # of conditional branches like beq, which are only in the decoded ones.
+    def get_relative(branches):
+        return { branch for branch in branches if (branch[1] >> 26) in { 16, 18 } and (branch[1] & 2) == 0 }
+
+    is_same = get_relative(results["per-word"]).issubset(get_relative(results["decoded"]))
+    is_same = is_same and results["detail"] == results["per-word"]
+
+    rows = [
+        ("Ranges", len(ranges)),
+        ("Branches", len(results["decoded"])),
+        ("Per-word detail", format_ms(per_word_time)),
+        ("Chunked detail", format_ms(detail_time)),
+        ("Decoded", format_ms(decoded_time)),
+        ("Speedup vs per-word", f"{per_word_time / decoded_time:.2f}x"),
+        ("Speedup vs chunked", f"{detail_time / decoded_time:.2f}x"),
+        ("Same result", is_same)
+    ]
+
+    util.print_table(("Discovery pass", "Value"), rows)
+
+def bench_branches(args):
+    if len(args) > 1:
+        print_help_and_exit()
+
+    if not asm._USE_NUMPY:
+        print("NumPy is not installed.")
+        sys.exit(1)
+
+    file_name = args[0] if len(args) > 0 else dol.DOL_FILE_NAME
+    data = read_text_section(file_name)
+
+    results = dict()
+
+    def run(name, func):
+        start = time.perf_counter()
+        results[name] = [values.tolist() for values in func(data, 0x80000000)]
+        return time.perf_counter() - start
+
+    slow_time = run("slow", asm._find_branches_slow)
+    numpy_time = run("numpy", asm.find_branches)
+
+    rows = [
+        ("Branches", len(results["numpy"][0])),
+        ("Python", format_ms(slow_time)),
+        ("NumPy", format_ms(numpy_time)),
+        ("Speedup", f"{slow_time / numpy_time:.2f}x"),
+        ("Same result", results["slow"] == results["numpy"])
+    ]
+
+    util.print_table(("Decode branches", "Value"), rows)
+
+def bench_disasm_cache(args):
+    if len(args) > 1:
+        print_help_and_exit()
+
+    file_name = args[0] if len(args) > 0 else dol.DOL_FILE_NAME
+
+    with open(file_name, "rb") as input:
+        dol_hash = disasm_cache.get_dol_hash(input.read())
+
+    data = read_text_section(file_name)
+    cache_file_name = util.ROOT_PATH / "Benchmark.cache"
+    results = dict()
+
+    def run(name):
+        start = time.perf_counter()
+
+        cache = disasm_cache.DisasmCache(cache_file_name)
+        cache.load(dol_hash)
+        results[name] = [values.tolist() for values in cache.find_branches(data, 0x80000000)]
+        cache.save()
+
+        return time.perf_counter() - start
+
+    try:
+        cold_time = run("cold")
+        warm_time = run("warm")
+    finally:
+        cache_file_name.unlink(missing_ok=True)
+
+    expected = [values.tolist() for values in asm.find_branches(data, 0x80000000)]
+
+    rows = [
+        ("Branches", len(expected[0])),
+        ("Cold", format_ms(cold_time)),
+        ("Warm", format_ms(warm_time)),
+        ("Speedup", f"{cold_time / warm_time:.2f}x"),
+        ("Same result", results["cold"] == results["warm"] == expected)
+    ]
+
+    util.print_table(("Disassembly cache", "Value"), rows)
+
+def bench_words(args):
+    # Finds the size of every function up to the padding and gets its
+    # instructions, like the function discovery passes used to
+    if len(args) > 1:
+        print_help_and_exit()
+
+    file_name = args[0] if len(args) > 0 else dol.DOL_FILE_NAME
+
+    with open(file_name, "rb") as input:
+        file_data = input.read()
+
+    main_dol = dol.Dol(file_name)
+    main_dol.open()
+
+    text1 = main_dol.get_section(".text1")
+    starts = [start for start, _ in get_padded_ranges(main_dol.get_view(text1))]
+    results = dict()
+
+    def read_unpack():
+        sizes = []
+
+        for start in starts:
+            offset = text1.offset + start
+            size = 4
+
+            while start + size < text1.size and struct.unpack_from(">I", file_data, offset + size)[0] != 0:
+                size += 4
+
+            func_data = file_data[offset:offset + size]
+            sizes.append((size, func_data[-4:]))
+
+        results["unpack"] = sizes
+
+    def read_words():
+        words = main_dol.read_words(text1)
+        view = main_dol.get_view(text1)
+        sizes = []
+
+        for start in starts:
+            index = start // 4
+            size = 4
+
+            while index + size // 4 < len(words) and words[index + size // 4] != 0:
+                size += 4
+
+            func_data = view[start:start + size]
+            sizes.append((size, func_data[-4:].tobytes()))
+
+        results["words"] = sizes
+
+    def read_padding_index():
+        padding = padding_index.PaddingIndex(main_dol.get_words(text1), 0)
+        view = main_dol.get_view(text1)
+        sizes = []
+
+        for start in starts:
+            size = padding.get_next_padding(start + 4) - start
+
+            func_data = view[start:start + size]
+            sizes.append((size, func_data[-4:].tobytes()))
+
+        results["padding"] = sizes
+
+    unpack_best, unpack_median = measure(read_unpack, 5)
+    words_best, words_median = measure(read_words, 5)
+    padding_best, padding_median = measure(read_padding_index, 5)
+
+    main_dol.close()
+
+    rows = [
+        ("struct.unpack_from and slices", format_ms(unpack_best), format_ms(unpack_median)),
+        ("Word tuple and memoryview", format_ms(words_best), format_ms(words_median)),
+        ("Padding index", format_ms(padding_best), format_ms(padding_median))
+    ]
+
+    util.print_table(("Read .text", "Best", "Median"), rows)
+
+    print()
+    print(f"Functions: {len(starts)}")
+    print(f"Speedup: {unpack_median / words_median:.2f}x, {unpack_median / padding_median:.2f}x with the padding index")
+    print(f"Same result: {results['unpack'] == results['words'] == results['padding']}")
+
+def main(args):
+    if len(args) < 1:
+        print_help_and_exit()
+
+    command = args[0]
+    rest = args[1:]
+
+    if command == "help":
+        print_help_and_exit()
+    elif command == "db-load":
+        bench_db_load(rest)
+    elif command == "demangle":
+        bench_demangle(rest)
+    elif command == "demangle-golden":
+        bench_demangle_golden(rest)
+    elif command == "disasm":
+        bench_disasm(rest)
+    elif command == "discovery":
+        bench_discovery(rest)
+    elif command == "branches":
+        bench_branches(rest)
+    elif command == "disasm-cache":
+        bench_disasm_cache(rest)
+    elif command == "words":
+        bench_words(rest)
+    else:
+        print(f"Invalid benchmark: {command}")
+        print()
+        print_help_and_exit()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
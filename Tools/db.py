@@ -1,9 +1,26 @@
+import address_index
+import bisect
+import demangle_cache
 import demangler
+import dol
+import hashlib
+import os
+import pickle
 import random
+import re
+import search_index
+import shlex
 import symbols
 import sys
 import util
-from collections import OrderedDict
+from array import array
+
+# Bump when the layout of the binary snapshot cache changes
+CACHE_VERSION = 2
+
+# The journal is folded into the symbol file on save once it has this many
+# entries, so it doesn't grow without bound
+COMPACT_JOURNAL_ENTRIES = 100
 
 def fix_fields_read(fields):
     for i in range(len(fields)):
@@ -13,189 +30,878 @@ def fix_fields_write(fields):
     for i in range(len(fields)):
         fields[i] = fields[i].replace(",", "&#44;")
 
-class SymbolInfo:
+FLAG_DECOMPILED = 0x01
+FLAG_TYPE_SHIFT = 1
+
+class StringTable:
+    # Dictionary encoding for the columns with few distinct values
     def __init__(self):
-        self.size = 0
-        self.matches = False
-        self.type = "F"
-        self.section = ".unk"
-        self.library = None
-        self.obj = None
-        self.symbol = None
+        self.strings = []
+        self.indices = dict()
+
+    def clear(self):
+        self.strings.clear()
+        self.indices.clear()
+
+    def load(self, strings):
+        self.strings = list(strings)
+        self.indices = { string: i for i, string in enumerate(self.strings) }
+
+    def get_index(self, string):
+        index = self.indices.get(string)
+
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(string)
+            self.indices[string] = index
+
+        return index
+
+    def __getitem__(self, index):
+        return self.strings[index]
+
+class SymbolInfo:
+    # View of a single row in the columns of a SymbolDB
+    __slots__ = ("db", "row")
+
+    def __init__(self, db, row):
+        self.db = db
+        self.row = row
+
+    @property
+    def address(self):
+        return self.db.addresses[self.row]
+
+    @property
+    def size(self):
+        return self.db.sizes[self.row]
+
+    @property
+    def matches(self):
+        return (self.db.flags[self.row] & FLAG_DECOMPILED) != 0
+
+    @property
+    def type(self):
+        return self.db.types[self.db.flags[self.row] >> FLAG_TYPE_SHIFT]
+
+    @property
+    def section(self):
+        return self.db.section_names[self.db.sections[self.row]]
+
+    @property
+    def library(self):
+        return self.db.library_names[self.db.libraries[self.row]]
+
+    @property
+    def obj(self):
+        return self.db.obj_names[self.db.objs[self.row]]
+
+    @property
+    def symbol(self):
+        return self.db.names[self.row]
 
 class SymbolDB:
     def __init__(self):
         self.file_name = util.ROOT_PATH / "Symbols" / "v1.1" / "USA" / "Symbols.csv"
-        self.symbols = OrderedDict()
+
+        # One entry per symbol in each column, rows are looked up by address
+        self.addresses = array("I")
+        self.sizes = array("I")
+        self.flags = array("B")
+        self.sections = array("H")
+        self.libraries = array("H")
+        self.objs = array("H")
+        self.names = []
+        self.rows = dict()
+
+        self.types = StringTable()
+        self.section_names = StringTable()
+        self.library_names = StringTable()
+        self.obj_names = StringTable()
+
+        self.symbol_addresses = dict()
+        self.duplicate_symbols = set()
+        self.address_index = address_index.AddressIndex()
+
+        # Library -> obj -> set of addresses
+        self.groups = dict()
+
+        self.demangle_cache = demangle_cache.DemangleCache(self.file_name.with_name("Demangled.cache"))
+        self.search_index = None
+        self.search_index_file_name = self.file_name.with_name("Search.cache")
+        self.is_search_index_dirty = False
+        self.use_cache = True
+        self.is_dirty = False
+        self.is_sorted = True
+        self.use_journal = True
+        self.is_replaying = False
+        self.pending_journal = []
+        self.journal_length = 0
+
+    def clear(self):
+        for column in (self.addresses, self.sizes, self.flags, self.sections, self.libraries, self.objs):
+            del column[:]
+
+        self.names.clear()
+        self.rows.clear()
+
+        for table in (self.types, self.section_names, self.library_names, self.obj_names):
+            table.clear()
+
+        self.symbol_addresses.clear()
+        self.duplicate_symbols.clear()
+        self.address_index.clear()
+        self.groups.clear()
+        self.search_index = None
+        self.is_search_index_dirty = False
+        self.is_dirty = False
+        self.is_sorted = True
+        self.pending_journal.clear()
+        self.journal_length = 0
 
     def load(self):
-        self.symbols.clear()
+        self.clear()
 
-        with open(self.file_name, "r") as input:
-            is_first_line = True
+        is_cached = self.use_cache and self._load_cache()
 
-            for line in input:
-                if is_first_line:
-                    is_first_line = False
-                    continue
-                
-                line_split = line.rstrip().split(",")
-                fix_fields_read(line_split)
+        if not is_cached:
+            with open(self.file_name, "rb") as input:
+                data = input.read()
 
-                if len(line_split) != 8:
-                    print(f"Invalid line: \"{line}\"")
-                    sys.exit()
+            self._parse_csv(data)
 
-                symbol = SymbolInfo()
+            if self.use_cache:
+                self._save_cache(data)
 
-                address = int(line_split[0], 16)
-                symbol.size = int(line_split[1], 16)
-                symbol.type = line_split[2]
-                symbol.section = line_split[3]
-                symbol.matches = line_split[4] == "T"
-                symbol.library = line_split[5]
-                symbol.obj = line_split[6]
-                symbol.symbol = line_split[7]
+        self.rows = { address: row for row, address in enumerate(self.addresses) }
 
-                self.symbols[address] = symbol
+        for row, name in enumerate(self.names):
+            self._index_symbol(self.addresses[row], name)
 
-    def save(self):
-        self.sort()
-        
-        with open(self.file_name, "w") as output:
-            output.write("Address,Size,Type,Section,Decompiled,Library,Obj,Name\n")
-
-            for address, info in self.symbols.items():
-                s_address = util.hex32(address)
-                s_size = util.hex24(info.size)
-                s_type = info.type
-                s_section = info.section
-                s_matches = 'T' if info.matches else 'F'
-                s_lib = info.library
-                s_obj = info.obj
-                s_symbol = info.symbol
-
-                fields = [s_address, s_size, s_type, s_section, s_matches, s_lib, s_obj, s_symbol]
+        for row, address in enumerate(self.addresses):
+            self._add_to_group(self.library_names[self.libraries[row]], self.obj_names[self.objs[row]], address)
+
+        self.address_index.build(self.addresses, self.sizes)
+        self.is_sorted = self.address_index.addresses == self.addresses
+
+        self._replay_journal()
+
+        # Replayed functions are appended at the end of the rows
+        if not self.is_sorted:
+            self.sort()
+
+    def get_journal_file_name(self):
+        return self.file_name.with_suffix(".journal")
+
+    def _replay_journal(self):
+        # Mutations saved since the last compaction are applied on top of
+        # the base file. Replaying an entry twice has no further effect.
+        try:
+            with open(self.get_journal_file_name(), "r") as input:
+                lines = input.read().split("\n")
+        except FileNotFoundError:
+            return
+
+        self.is_replaying = True
+        self.journal_length = len(lines) - 1
+
+        # The last line is either empty or was cut off by an interrupted save
+        for line_nr, line in enumerate(lines[:-1], 1):
+            fields = line.split(",")
+            fix_fields_read(fields)
+
+            # A bad entry must not make every later command fail
+            try:
+                self._apply_journal_entry(fields)
+            except (ValueError, IndexError, KeyError, AssertionError):
+                print(f"Skipped invalid journal entry on line {line_nr}: \"{line}\"")
+
+        self.is_replaying = False
+        self.is_dirty = False
+
+    def _apply_journal_entry(self, fields):
+        command = fields[0]
+        address = int(fields[1], 16)
+
+        if command == "add-function":
+            size = int(fields[2], 16)
+
+            if self.does_address_exist(address):
+                self.set_size(address, size)
+            else:
+                self.add_function(address, size)
+        elif command == "set-symbol":
+            self.set_symbol(address, fields[2])
+        elif command == "set-obj":
+            self.set_obj(address, fields[2])
+        elif command == "set-library":
+            self.set_library(address, fields[2])
+        elif command == "move":
+            self.move(address, fields[2], fields[3])
+        elif command == "set-size":
+            self.set_size(address, int(fields[2], 16))
+        elif command == "mark-decompiled":
+            self.mark_function_decompiled(address, fields[2] == "T")
+        else:
+            raise ValueError(f"Invalid journal command: {command}")
+
+    def _truncate_journal(self):
+        # Drops a last line cut off by an interrupted save, which replay
+        # ignores, so that new entries don't get appended to it
+        try:
+            with open(self.get_journal_file_name(), "r+b") as file:
+                data = file.read()
+
+                if len(data) > 0 and not data.endswith(b"\n"):
+                    file.truncate(data.rfind(b"\n") + 1)
+        except FileNotFoundError:
+            pass
+
+    def _append_journal(self):
+        self._truncate_journal()
+
+        with open(self.get_journal_file_name(), "a") as output:
+            for fields in self.pending_journal:
                 fix_fields_write(fields)
-                                                    
-                line = ",".join(fields)
-                output.write(f"{line}\n")
+                output.write(",".join(fields) + "\n")
+
+            output.flush()
+            os.fsync(output.fileno())
+
+        self.journal_length += len(self.pending_journal)
+        self.pending_journal.clear()
+        self.is_dirty = False
+
+    def _append_row(self, address, size, type, section, matches, library, obj, name):
+        flags = self.types.get_index(type) << FLAG_TYPE_SHIFT
+
+        if matches:
+            flags |= FLAG_DECOMPILED
+
+        self.addresses.append(address)
+        self.sizes.append(size)
+        self.flags.append(flags)
+        self.sections.append(self.section_names.get_index(section))
+        self.libraries.append(self.library_names.get_index(library))
+        self.objs.append(self.obj_names.get_index(obj))
+        self.names.append(name)
+
+    def _parse_csv(self, data):
+        is_first_line = True
+
+        for line in data.decode("utf-8").splitlines():
+            if is_first_line:
+                is_first_line = False
+                continue
+
+            line_split = line.rstrip().split(",")
+            fix_fields_read(line_split)
+
+            if len(line_split) != 8:
+                print(f"Invalid line: \"{line}\"")
+                sys.exit()
+
+            address = int(line_split[0], 16)
+            size = int(line_split[1], 16)
+            matches = line_split[4] == "T"
+
+            self._append_row(address, size, line_split[2], line_split[3], matches, line_split[5], line_split[6], line_split[7])
+
+    def get_cache_file_name(self):
+        return self.file_name.with_suffix(".cache")
+
+    def _load_cache(self):
+        # The cache is fresh if the CSV has the same mtime and size as when the
+        # cache was written. If only the mtime differs (e.g. after a checkout),
+        # the content hash decides.
+        try:
+            stat = os.stat(self.file_name)
+
+            with open(self.get_cache_file_name(), "rb") as input:
+                cache = pickle.load(input)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+
+        if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+            return False
+
+        if cache["size"] != stat.st_size:
+            return False
+
+        if cache["mtime"] != stat.st_mtime_ns:
+            with open(self.file_name, "rb") as input:
+                data = input.read()
+
+            if hashlib.sha1(data).hexdigest() != cache["hash"]:
+                return False
+
+            cache["mtime"] = stat.st_mtime_ns
+            self._write_cache(cache)
+
+        columns = cache["columns"]
+
+        for name, column in self._get_columns().items():
+            column.frombytes(columns[name])
+
+        for name, table in self._get_tables().items():
+            table.load(cache["tables"][name])
+
+        self.names = cache["names"]
+
+        return True
+
+    def _save_cache(self, data):
+        stat = os.stat(self.file_name)
+
+        cache = {
+            "version": CACHE_VERSION,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": hashlib.sha1(data).hexdigest(),
+            "columns": { name: column.tobytes() for name, column in self._get_columns().items() },
+            "tables": { name: table.strings for name, table in self._get_tables().items() },
+            "names": self.names
+        }
+
+        self._write_cache(cache)
+
+    def _write_cache(self, cache):
+        try:
+            with open(self.get_cache_file_name(), "wb") as output:
+                pickle.dump(cache, output, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+
+    def _get_columns(self):
+        return {
+            "addresses": self.addresses,
+            "sizes": self.sizes,
+            "flags": self.flags,
+            "sections": self.sections,
+            "libraries": self.libraries,
+            "objs": self.objs
+        }
+
+    def _get_tables(self):
+        return {
+            "types": self.types,
+            "sections": self.section_names,
+            "libraries": self.library_names,
+            "objs": self.obj_names
+        }
+
+    def _index_symbol(self, address, symbol):
+        if not symbol:
+            return
+
+        addresses = self.symbol_addresses.get(symbol)
+
+        if addresses is None:
+            self.symbol_addresses[symbol] = [address]
+        else:
+            bisect.insort(addresses, address)
+            self.duplicate_symbols.add(symbol)
+
+    def _unindex_symbol(self, address, symbol):
+        if not symbol:
+            return
+
+        addresses = self.symbol_addresses[symbol]
+        addresses.remove(address)
+
+        if len(addresses) == 0:
+            del self.symbol_addresses[symbol]
+
+        if len(addresses) <= 1:
+            self.duplicate_symbols.discard(symbol)
+
+    def _add_to_group(self, library, obj, address):
+        objs = self.groups.get(library)
+
+        if objs is None:
+            objs = dict()
+            self.groups[library] = objs
+
+        addresses = objs.get(obj)
+
+        if addresses is None:
+            addresses = set()
+            objs[obj] = addresses
+
+        addresses.add(address)
+
+    def _remove_from_group(self, library, obj, address):
+        objs = self.groups[library]
+        addresses = objs[obj]
+        addresses.remove(address)
+
+        if len(addresses) == 0:
+            del objs[obj]
+
+            if len(objs) == 0:
+                del self.groups[library]
+
+    def save(self):
+        if self.use_cache:
+            self.demangle_cache.save()
+
+            if self.is_search_index_dirty:
+                self.search_index.save(self.search_index_file_name, self._get_search_index_key())
+                self.is_search_index_dirty = False
+
+        if not self.is_dirty:
+            return
+
+        if self.use_journal and self.journal_length + len(self.pending_journal) < COMPACT_JOURNAL_ENTRIES:
+            self._append_journal()
+        else:
+            self.compact()
+
+    def compact(self):
+        # Writes the whole database to the CSV and folds the journal into it
+        journal_file_name = self.get_journal_file_name()
+
+        if not self.is_dirty and not os.path.exists(journal_file_name):
+            return
+
+        if not self.is_sorted:
+            self.sort()
+
+        # Write to a temporary file and rename it over the database so that
+        # an interrupted save never leaves a truncated file behind
+        temp_file_name = self.file_name.with_name(self.file_name.name + ".tmp")
+
+        try:
+            with open(temp_file_name, "w") as output:
+                output.write("Address,Size,Type,Section,Decompiled,Library,Obj,Name\n")
+
+                for info in self.get_all_infos():
+                    s_address = util.hex32(info.address)
+                    s_size = util.hex24(info.size)
+                    s_type = info.type
+                    s_section = info.section
+                    s_matches = 'T' if info.matches else 'F'
+                    s_lib = info.library
+                    s_obj = info.obj
+                    s_symbol = info.symbol
+
+                    fields = [s_address, s_size, s_type, s_section, s_matches, s_lib, s_obj, s_symbol]
+                    fix_fields_write(fields)
+                                                        
+                    line = ",".join(fields)
+                    output.write(f"{line}\n")
+
+                output.flush()
+                os.fsync(output.fileno())
+
+            os.replace(temp_file_name, self.file_name)
+        except BaseException:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+
+            raise
+
+        if os.path.exists(journal_file_name):
+            os.remove(journal_file_name)
+
+        self.pending_journal.clear()
+        self.journal_length = 0
+        self.is_dirty = False
+
+        if self.use_cache:
+            with open(self.file_name, "rb") as input:
+                data = input.read()
+
+            self._save_cache(data)
            
     def sort(self):
-        self.symbols = OrderedDict(sorted(self.symbols.items()))
+        order = sorted(range(len(self.addresses)), key=self.addresses.__getitem__)
+
+        for column in self._get_columns().values():
+            sorted_column = array(column.typecode, (column[row] for row in order))
+            column[:] = sorted_column
+
+        self.names = [self.names[row] for row in order]
+        self.rows = { address: row for row, address in enumerate(self.addresses) }
+        self.is_sorted = True
+
+    def get_info(self, address):
+        row = self.rows.get(address)
+
+        if row is None:
+            return None
+
+        return SymbolInfo(self, row)
+
+    def get_all_infos(self):
+        for row in range(len(self.addresses)):
+            yield SymbolInfo(self, row)
 
     def does_address_exist(self, address):
-        return address in self.symbols;
+        return address in self.rows
 
     def does_symbol_exist(self, symbol):
-        for info in self.symbols.values():
-            if info.symbol == symbol:
-                return True
-
-        return False
+        return symbol in self.symbol_addresses
     
     def get_address_from_symbol(self, symbol):
-        for address, info in self.symbols.items():
-            if info.symbol == symbol:
-                return address
+        addresses = self.symbol_addresses.get(symbol)
 
-        return None
+        if addresses is None:
+            return None
+
+        return addresses[0]
+
+    def get_addresses_from_symbol(self, symbol):
+        return list(self.symbol_addresses.get(symbol, []))
+
+    def get_duplicate_symbols(self):
+        return sorted(self.duplicate_symbols)
 
     def get_size(self, address):
-        if address in self.symbols:
-            return self.symbols[address].size
+        row = self.rows.get(address)
+
+        if row is not None:
+            return self.sizes[row]
             
         return 0
 
     def get_symbol(self, address):
-        if address in self.symbols:
-            return self.symbols[address].symbol
+        row = self.rows.get(address)
+
+        if row is not None:
+            return self.names[row]
             
         return None
 
     def get_demangled_symbol(self, address):
-        if address in self.symbols:
-            mangled = self.symbols[address].symbol
+        row = self.rows.get(address)
+
+        if row is not None:
+            mangled = self.names[row]
 
             if not mangled:
                 return ""
 
             try:
-                return demangler.demangle_symbol(mangled)
+                return self.demangle(mangled)
             except demangler.DemanglerException:
                 return None
             
         return None
 
+    def demangle(self, mangled):
+        # Only the cached strings are needed, the trees are not loaded
+        if self.use_cache:
+            return self.demangle_cache.demangle(mangled)
+
+        return demangler.demangle_symbol(mangled)
+
+    def demangle_tree(self, mangled):
+        if self.use_cache:
+            return self.demangle_cache.demangle_tree(mangled)
+
+        return demangler.demangle_symbol_tree(mangled)
+
+    def get_demangled_tree(self, address):
+        mangled = self.get_symbol(address)
+
+        if not mangled:
+            return None
+
+        try:
+            return self.demangle_tree(mangled)
+        except demangler.DemanglerException:
+            return None
+
+    def get_demangle_stats(self):
+        return self.demangle_cache.get_stats()
+
     def get_sym_type(self, address):
-        if address in self.symbols:
-            return self.symbols[address].type
+        row = self.rows.get(address)
+
+        if row is not None:
+            return self.types[self.flags[row] >> FLAG_TYPE_SHIFT]
             
         return None
 
+    def get_section(self, address):
+        row = self.rows.get(address)
+
+        if row is not None:
+            return self.section_names[self.sections[row]]
+
+        return None
+
     def get_obj(self, address):
-        if address in self.symbols:
-            return self.symbols[address].obj
+        row = self.rows.get(address)
+
+        if row is not None:
+            return self.obj_names[self.objs[row]]
             
         return None
 
     def get_library(self, address):
-        if address in self.symbols:
-            return self.symbols[address].library
+        row = self.rows.get(address)
+
+        if row is not None:
+            return self.library_names[self.libraries[row]]
             
         return None
 
     def is_marked_decompiled(self, address):
-        if address in self.symbols:
-            return self.symbols[address].matches
+        row = self.rows.get(address)
+
+        if row is not None:
+            return (self.flags[row] & FLAG_DECOMPILED) != 0
 
         return False
         
+    def _record(self, *fields):
+        self.is_dirty = True
+
+        if not self.is_replaying:
+            self.pending_journal.append([str(field) for field in fields])
+
     def add_function(self, address, size):
-        assert not address in self.symbols
-        
-        info = SymbolInfo()
+        assert not address in self.rows
+
+        if len(self.addresses) > 0 and address < self.addresses[-1]:
+            self.is_sorted = False
+
+        self.rows[address] = len(self.addresses)
+        self._append_row(address, size, "F", ".unk", False, "", "", "")
+        self._add_to_group("", "", address)
+        self.address_index.insert(address, size)
+        self._record("add-function", util.hex32(address), util.hex24(size))
+
+    def set_symbol(self, address, symbol):
+        row = self.rows[address]
+
+        if self.names[row] == symbol:
+            return
+
+        old_symbol = self.names[row]
+
+        self._unindex_symbol(address, old_symbol)
+
+        if not self.does_symbol_exist(old_symbol):
+            self.demangle_cache.invalidate(old_symbol)
+
+        self.names[row] = symbol
+        self._index_symbol(address, symbol)
+
+        if self.search_index is not None:
+            self.search_index.remove(address)
+            self._add_to_search_index(address, symbol)
+            self.is_search_index_dirty = True
+        self._record("set-symbol", util.hex32(address), symbol)
+
+    def set_obj(self, address, obj):
+        row = self.rows[address]
+        index = self.obj_names.get_index(obj)
+
+        if self.objs[row] == index:
+            return
+
+        library = self.library_names[self.libraries[row]]
+
+        self._remove_from_group(library, self.obj_names[self.objs[row]], address)
+        self._add_to_group(library, obj, address)
+
+        self.objs[row] = index
+        self._record("set-obj", util.hex32(address), obj)
+
+    def set_library(self, address, library):
+        row = self.rows[address]
+        index = self.library_names.get_index(library)
+
+        if self.libraries[row] == index:
+            return
+
+        obj = self.obj_names[self.objs[row]]
+
+        self._remove_from_group(self.library_names[self.libraries[row]], obj, address)
+        self._add_to_group(library, obj, address)
 
-        info.size = size
-        info.symbol = ""
-        info.type = "F"
-        info.obj = ""
-        info.library = ""
-        info.matches = False
+        self.libraries[row] = index
+        self._record("set-library", util.hex32(address), library)
 
-        self.symbols[address] = info
+    def move(self, address, obj, library):
+        row = self.rows[address]
+        obj_index = self.obj_names.get_index(obj)
+        library_index = self.library_names.get_index(library)
+
+        if self.objs[row] == obj_index and self.libraries[row] == library_index:
+            return
+
+        self._remove_from_group(self.library_names[self.libraries[row]], self.obj_names[self.objs[row]], address)
+        self._add_to_group(library, obj, address)
+
+        self.objs[row] = obj_index
+        self.libraries[row] = library_index
+        self._record("move", util.hex32(address), obj, library)
 
     def set_size(self, address, size):
-        self.symbols[address].size = size
+        row = self.rows[address]
+
+        if self.sizes[row] == size:
+            return
+
+        self.sizes[row] = size
+        self.address_index.set_size(address, size)
+        self._record("set-size", util.hex32(address), util.hex24(size))
+
+    def find_containing(self, address):
+        return self.address_index.find_containing(address)
+
+    def get_addresses_in_range(self, start, end):
+        return self.address_index.range(start, end)
+
+    def get_next_address(self, address):
+        return self.address_index.next(address)
+
+    def get_prev_address(self, address):
+        return self.address_index.prev(address)
 
     def mark_function_decompiled(self, address, decompiled):
-        self.symbols[address].matches = decompiled
+        row = self.rows[address]
+        flags = self.flags[row]
+
+        if decompiled:
+            self.flags[row] |= FLAG_DECOMPILED
+        else:
+            self.flags[row] &= ~FLAG_DECOMPILED
+
+        if self.flags[row] == flags:
+            return
+
+        self._record("mark-decompiled", util.hex32(address), "T" if decompiled else "F")
         
     def get_functions_marked_as_decompiled(self):
-        for address, info in self.symbols.items():
-            if info.matches:
-                yield address
+        for row, flags in enumerate(self.flags):
+            if flags & FLAG_DECOMPILED:
+                yield self.addresses[row]
 
     def get_all_functions(self):
-        for address in self.symbols.keys():
+        # In address order, also after functions were added
+        if not self.is_sorted:
+            self.sort()
+
+        for address in self.addresses:
             yield address
 
-    def search_functions(self, pattern):
-        pattern = pattern.lower()
+    def get_libraries(self):
+        return list(self.groups.keys())
 
-        for address, info in self.symbols.items():
-            mangled = info.symbol
+    def get_objs(self, library):
+        return list(self.groups.get(library, {}).keys())
 
-            if not mangled:
-                continue
+    def get_functions_in_obj(self, obj, library):
+        return sorted(self.groups.get(library, {}).get(obj, ()))
 
-            try:
-                demangled = demangler.demangle_symbol(mangled)
-            except:
-                continue
+    def get_functions_in_obj_any_library(self, obj):
+        addresses = []
+
+        for objs in self.groups.values():
+            addresses.extend(objs.get(obj, ()))
+
+        return sorted(addresses)
+
+    def get_function_count(self, library, obj=None):
+        objs = self.groups.get(library, {})
+
+        if obj is not None:
+            return len(objs.get(obj, ()))
+
+        return sum(len(addresses) for addresses in objs.values())
+
+    def _get_search_texts(self, mangled):
+        if not mangled:
+            return []
+
+        try:
+            demangled = self.demangle(mangled)
+        except demangler.DemanglerException:
+            demangled = None
+
+        return [demangled, mangled]
+
+    def _add_to_search_index(self, address, mangled):
+        texts = self._get_search_texts(mangled)
+
+        if len(texts) > 0:
+            self.search_index.add(address, texts)
+
+    def _get_search_index_key(self):
+        # Any change to a name, an address or the demangler rebuilds the index
+        key = hashlib.sha1()
+        key.update("\n".join(self.names).encode("utf-8"))
+        key.update(self.addresses.tobytes())
+        key.update(demangle_cache.get_demangler_hash().encode("ascii"))
+
+        return key.hexdigest()
+
+    def get_search_index(self):
+        # Loaded from the search cache when it matches the symbols, built
+        # otherwise, and kept up to date by set_symbol afterwards
+        if self.search_index is None:
+            self.search_index = search_index.SearchIndex()
+
+            if self.use_cache and self.search_index.load(self.search_index_file_name, self._get_search_index_key()):
+                return self.search_index
+
+            for row, mangled in enumerate(self.names):
+                self._add_to_search_index(self.addresses[row], mangled)
+
+            self.is_search_index_dirty = True
+
+        return self.search_index
+
+    def _matches_fields(self, address, fields):
+        for field, value in fields.items():
+            if field == "lib":
+                actual = self.get_library(address)
+            elif field == "obj":
+                actual = self.get_obj(address)
+            elif field == "section":
+                actual = self.get_section(address)
+            elif field == "type":
+                actual = self.get_sym_type(address)
+            elif field == "decompiled":
+                actual = "T" if self.is_marked_decompiled(address) else "F"
+                value = value[:1]
+
+            if actual is None or actual.lower() != value.lower():
+                return False
+
+        return True
+
+    def search_functions(self, pattern, limit=None):
+        # Supports substrings, regexes and field filters, see search_index.parse_query
+        query = search_index.parse_query(pattern)
+        candidates = None
+
+        if "lib" in query.fields or "obj" in query.fields:
+            target_lib = query.fields.get("lib", "").lower()
+            target_obj = query.fields.get("obj", "").lower()
+            candidates = set()
 
-            if pattern in demangled.lower():
-                yield address
+            for lib, objs in self.groups.items():
+                if target_lib and lib.lower() != target_lib:
+                    continue
+
+                for obj, addresses in objs.items():
+                    if target_obj and obj.lower() != target_obj:
+                        continue
+
+                    candidates.update(addresses)
+
+        if len(query.fields) > 0:
+            fields = query.fields
+            source = candidates if candidates is not None else self.rows.keys()
+            candidates = { address for address in source if self._matches_fields(address, fields) }
+
+        return self.get_search_index().search(query, candidates, limit)
 
 def get_obj_display_name(obj):
     if obj:
@@ -209,10 +915,48 @@ def get_lib_display_name(lib):
 
     return "?"
 
+def get_ghidra_name(tree):
+    # Ghidra's symbol map can't have spaces in a name
+    if tree.kind == demangler.SYMBOL_PLAIN:
+        return tree.mangled.replace(" ", "")
+
+    pieces = []
+
+    if tree.return_type is not None:
+        pieces.append(tree.return_type.to_string())
+
+    if tree.namespace is not None:
+        pieces.append(f"{tree.namespace.to_string()}::")
+
+    pieces.append(tree.get_display_name())
+
+    if tree.is_function():
+        pieces.append("(")
+        pieces.append(",".join(arg.to_string() for arg in tree.parameters))
+        pieces.append(")")
+
+        if tree.is_const:
+            pieces.append("const")
+
+    return "".join(piece.replace(" ", "") for piece in pieces)
+
+class UsageError(Exception):
+    pass
+
+# Set while running the commands of a batch, where invalid arguments must
+# not end the whole process
+is_batch_mode = False
+
 def print_help_and_exit():
+    if is_batch_mode:
+        raise UsageError("Invalid arguments.")
+
     print("Usage: db.py <command> [addition flags]")
     print()
 
+    print("Add --stats to any command to print demangle cache statistics afterwards.")
+    print()
+
     print("To add a new function, use:")
     print("db.py add-data <address> <symbol>")
     print()
@@ -221,6 +965,17 @@ def print_help_and_exit():
     print("db.py add-func <address> <size> <obj> <lib>")
     print()
 
+    print("To run many commands from a file (or - for stdin) with a single save, use:")
+    print("db.py batch <file> [--transaction]")
+    print("With --transaction, nothing is saved if any command fails.")
+    print()
+
+    print("To fold the journal of saved changes into the symbol file, use:")
+    print("db.py compact")
+    print(f"This is done automatically once the journal has {COMPACT_JOURNAL_ENTRIES} entries.")
+    print("Run it before committing Symbols.csv, changes in Symbols.journal are not part of it.")
+    print()
+
     print("To display this help, use:")
     print("db.py help")
     print()
@@ -229,6 +984,10 @@ def print_help_and_exit():
     print("db.py func <address>")
     print()
 
+    print("To find the symbol containing an address, use:")
+    print("db.py find <address>")
+    print()
+
     print("To generate a symbol map, use:")
     print("db.py gen-map <type> <path>")
     print()
@@ -265,7 +1024,10 @@ def print_help_and_exit():
     print()
 
     print("To search for functions, use:")
-    print("db.py search-func <pattern>")
+    print("db.py search-func <pattern> [--limit <n>]")
+    print("The pattern may contain regexes (re:<regex> or /<regex>/) and filters:")
+    print("lib:<lib> obj:<obj> section:<section> type:<type> decompiled:<T|F>")
+    print("Terms with spaces have to be quoted, e.g. 're:\\(void\\) const$'.")
     print()
 
     print("To set the symbol of a function, use:")
@@ -295,6 +1057,13 @@ def print_help_and_exit():
 
     sys.exit()
 
+def print_error(message):
+    # Failed commands have to fail the batch they are in
+    if is_batch_mode:
+        raise UsageError(message)
+
+    print(message)
+
 def add_data(data_db, args):
     if len(args) != 2:
         print_help_and_exit()
@@ -303,7 +1072,7 @@ def add_data(data_db, args):
     symbol = args[1]
 
     if data_db.does_address_exist(address):
-        print("Address already exists.")
+        print_error("Address already exists.")
         return
 
     print("Not implemented")
@@ -316,7 +1085,7 @@ def func_info(sym_db, args):
     address = int(args[0], 16)
 
     if not sym_db.does_address_exist(address):
-        print("Function does not exist.")
+        print_error("Function does not exist.")
         return
 
     print(f"Declaration:   {sym_db.get_demangled_symbol(address)}")
@@ -326,6 +1095,40 @@ def func_info(sym_db, args):
     print(f"Library:       {get_lib_display_name(sym_db.get_library(address))}")
     print(f"Obj:           {get_obj_display_name(sym_db.get_obj(address))}")
 
+def compact(sym_db, args):
+    if len(args) != 0:
+        print_help_and_exit()
+
+    sym_db.compact()
+
+def find_symbol(sym_db, args):
+    if len(args) != 1:
+        print_help_and_exit()
+
+    address = int(args[0], 16)
+    start = sym_db.find_containing(address)
+
+    if start is None:
+        print("No symbol contains the address.")
+
+        prev_address = sym_db.get_prev_address(address)
+        next_address = sym_db.get_next_address(address)
+
+        if prev_address is not None:
+            print(f"Previous:      {util.hex32(prev_address)} {sym_db.get_demangled_symbol(prev_address)}")
+
+        if next_address is not None:
+            print(f"Next:          {util.hex32(next_address)} {sym_db.get_demangled_symbol(next_address)}")
+
+        return
+
+    print(f"Declaration:   {sym_db.get_demangled_symbol(start)}")
+    print(f"Address:       {util.hex32(start)}")
+    print(f"Offset:        {util.hex24(address - start)}")
+    print(f"Size:          {util.hex24(sym_db.get_size(start))}")
+    print(f"Library:       {get_lib_display_name(sym_db.get_library(start))}")
+    print(f"Obj:           {get_obj_display_name(sym_db.get_obj(start))}")
+
 def gen_map(sym_db, args):
     if len(args) != 2:
         print_help_and_exit()
@@ -341,15 +1144,22 @@ def gen_map(sym_db, args):
             output.write("  Starting        Virtual\n")
             output.write("  address  Size   address\n")
 
+            # Offsets are relative to .text1, read from main.dol when there is one
             TEXT1_ADDRESS = 0x80006EA0
 
+            text1_address = TEXT1_ADDRESS
+
+            if dol.DOL_FILE_NAME.exists():
+                with dol.Dol() as main_dol:
+                    text1_address = main_dol.get_section(".text1").address
+
             for address in sym_db.get_all_functions():
                 symbol = sym_db.get_symbol(address)
 
                 if not symbol:
                     continue
 
-                text1_offset = address - TEXT1_ADDRESS
+                text1_offset = address - text1_address
                 size = sym_db.get_size(address)
 
                 output.write(f"  {util.hex32(text1_offset)} {util.hex24(size)} {util.hex32(address)} {util.hex32(0)}: {symbol}\n")
@@ -360,11 +1170,8 @@ def gen_map(sym_db, args):
                 if not symbol:
                     continue
 
-                try:
-                    demangled = demangler.demangle_symbol(symbol)
-                    name = demangled.replace(" ", "")
-                except:
-                    name = symbol
+                tree = sym_db.get_demangled_tree(address)
+                name = get_ghidra_name(tree) if tree is not None else symbol
 
                 symbol_type = sym_db.get_sym_type(address)
 
@@ -387,41 +1194,23 @@ def gen_map(sym_db, args):
                 output.write(f"{util.hex32(address)} {symbol}\n")
         else:
             types_string = ", ".join(TYPES)
-            print(f"Invalid symbol map type. Must be one of the following: {types_string}")
+            print_error(f"Invalid symbol map type. Must be one of the following: {types_string}")
         
 def list_libs(sym_db, args):
     if len(args) > 0:
         print_help_and_exit()
 
-    libs = set()
-    lib_objs = dict()
-    lib_func = dict()
-
-    for address in sym_db.get_all_functions():
-        lib = sym_db.get_library(address)
-        obj = sym_db.get_obj(address)
-
-        if lib and obj:
-            if lib in libs:
-                if not obj in lib_objs[lib]:
-                    lib_objs[lib].add(obj)
-
-                lib_func[lib] += 1
-            else:
-                libs.add(lib)
-
-                lib_objs[lib] = set()
-                lib_objs[lib].add(obj)
+    table = []
 
-                lib_func[lib] = 1
-                
+    for lib in sorted(filter(None, sym_db.get_libraries()), key=str.casefold):
+        objs = [obj for obj in sym_db.get_objs(lib) if obj]
 
-    libs = sorted(list(libs), key=str.casefold)
+        if len(objs) == 0:
+            continue
 
-    table = []
+        func_count = sum(sym_db.get_function_count(lib, obj) for obj in objs)
 
-    for lib in libs:
-        table.append((get_lib_display_name(lib), len(lib_objs[lib]), lib_func[lib]))
+        table.append((get_lib_display_name(lib), len(objs), func_count))
 
     util.print_table(("Library", "Obj count", "Function count"), table)
 
@@ -431,26 +1220,12 @@ def list_objs(sym_db, args):
 
     target_lib = args[0]
 
-    objs = set()
-    obj_func = dict()
-
-    for address in sym_db.get_all_functions():
-        lib = sym_db.get_library(address)
-        obj = sym_db.get_obj(address)
-
-        if lib == target_lib and obj:
-            if obj in objs:
-                obj_func[obj] += 1
-            else:
-                objs.add(obj)
-                obj_func[obj] = 1
-
-    objs = sorted(list(objs), key=str.casefold)
+    objs = sorted(filter(None, sym_db.get_objs(target_lib)), key=str.casefold)
 
     table = []
 
     for obj in objs:
-        table.append((get_obj_display_name(obj), obj_func[obj]))
+        table.append((get_obj_display_name(obj), sym_db.get_function_count(target_lib, obj)))
 
     util.print_table(("Obj", "Function count"), table)
 
@@ -461,13 +1236,7 @@ def list_func(sym_db, args):
 
     target_obj = args[0]
 
-    addresses = []
-
-    for address in sym_db.get_all_functions():
-        obj = sym_db.get_obj(address)
-
-        if obj == target_obj:
-            addresses.append(address)
+    addresses = sym_db.get_functions_in_obj_any_library(target_obj)
 
     rows = []
 
@@ -492,7 +1261,7 @@ def move_func(sym_db, args):
     lib = args[2]
 
     if not sym_db.does_address_exist(address):
-        print("Function does not exist.")
+        print_error("Function does not exist.")
         return
         
     old_obj = sym_db.get_obj(address)
@@ -502,8 +1271,7 @@ def move_func(sym_db, args):
         print("Function is already placed in the specified obj file and library.")
         return
 
-    sym_db.set_obj(address, obj)
-    sym_db.set_library(address, lib)
+    sym_db.move(address, obj, lib)
     
     assert sym_db.get_obj(address) == obj
     assert sym_db.get_library(address) == lib
@@ -524,7 +1292,7 @@ def move_multi_func(sym_db, args):
     lib = args[3]
     
     if first_address > last_address:
-        print("Invalid addresses.")
+        print_error("Invalid addresses.")
         return
 
     move_count = 0
@@ -546,8 +1314,7 @@ def move_multi_func(sym_db, args):
         print(f"Obj:     {get_obj_display_name(old_obj)} -> {get_obj_display_name(obj)}")
         print(f"Library: {get_lib_display_name(old_lib)} -> {get_lib_display_name(lib)}")
             
-        sym_db.set_obj(address, obj)
-        sym_db.set_library(address, lib)
+        sym_db.move(address, obj, lib)
 
         print()
 
@@ -624,19 +1391,19 @@ def random_obj(sym_db, rest):
     objs = []
     obj_set = dict()
 
-    for address in sym_db.get_all_functions():
-        if not sym_db.is_marked_decompiled(address):
-            obj = sym_db.get_obj(address)
-            lib = sym_db.get_library(address)
+    for lib in filter(None, sym_db.get_libraries()):
+        for obj in filter(None, sym_db.get_objs(lib)):
+            func_count = 0
+
+            for address in sym_db.get_functions_in_obj(obj, lib):
+                if not sym_db.is_marked_decompiled(address):
+                    func_count += 1
 
-            if obj and lib:
+            if func_count > 0:
                 pair = (obj, lib)
 
-                if pair in obj_set:
-                    obj_set[pair] += 1
-                else:
-                    objs.append(pair)
-                    obj_set[pair] = 1
+                objs.append(pair)
+                obj_set[pair] = func_count
         
     obj_table = []
 
@@ -667,27 +1434,40 @@ def rename_obj(sym_db, args):
 
     count = 0
 
-    for address in sym_db.get_all_functions():
-        obj = sym_db.get_obj(address)
-        lib = sym_db.get_library(address)
-
-        if obj == old_obj and lib == old_lib:
-            sym_db.set_obj(address, new_obj)
-            sym_db.set_library(address, new_lib)
+    for address in sym_db.get_functions_in_obj(old_obj, old_lib):
+        sym_db.move(address, new_obj, new_lib)
 
-            count += 1
+        count += 1
 
     print(f"{count} function(s) were moved.")        
 
 def search_func(sym_db, args):
-    if len(args) != 1:
+    limit = None
+
+    if "--limit" in args:
+        index = args.index("--limit")
+
+        if index + 1 >= len(args):
+            print_help_and_exit()
+
+        limit = int(args[index + 1])
+        args = args[:index] + args[index + 2:]
+
+    if len(args) < 1:
         print_help_and_exit()
 
-    pattern = args[0]
+    # Arguments with spaces stay single terms, e.g. 're:\(void\) const$'
+    pattern = " ".join(f"\"{arg}\"" if " " in arg else arg for arg in args)
+
+    try:
+        addresses = sym_db.search_functions(pattern, limit)
+    except re.error as e:
+        print_error(f"Invalid regex: {e}")
+        return
 
     rows = []
 
-    for address in sym_db.search_functions(pattern):
+    for address in addresses:
         size = sym_db.get_size(address)
         demangled = sym_db.get_demangled_symbol(address)
         obj = sym_db.get_obj(address)
@@ -706,7 +1486,7 @@ def set_symbol(sym_db, args):
     symbol = args[1]
 
     if not sym_db.does_address_exist(address):
-        print("Function does not exist.")
+        print_error("Function does not exist.")
         return
 
     if symbol != "":
@@ -715,7 +1495,7 @@ def set_symbol(sym_db, args):
             return
 
         if sym_db.does_symbol_exist(symbol):
-            print("Symbol already exists.")
+            print_error("Symbol already exists.")
             return
 
     old_demangled = sym_db.get_demangled_symbol(address)
@@ -739,11 +1519,11 @@ def set_size(sym_db, args):
     size = int(args[1], 16)
 
     if size % 4 != 0:
-        print("Size must be a multiple of 4.")
+        print_error("Size must be a multiple of 4.")
         return
 
     if not sym_db.does_address_exist(address):
-        print("Function does not exist.")
+        print_error("Function does not exist.")
         return
 
     old_size = sym_db.get_size(address)
@@ -799,7 +1579,7 @@ def unset_symbol(sym_db, args):
     address = int(args[0], 16)
 
     if not sym_db.does_address_exist(address):
-        print("Function does not exist.")
+        print_error("Function does not exist.")
         return
 
     old_demangled = sym_db.get_demangled_symbol(address)
@@ -823,62 +1603,143 @@ def validate(sym_db, args):
 
         if symbol:
             try:
-                demangler.demangle_symbol(symbol)
+                sym_db.demangle(symbol)
             except demangler.DemanglerException:
                 print(f"Failed to demangle symbol at 0x{util.hex32(address)}: {symbol}")
 
+    for symbol in sym_db.get_duplicate_symbols():
+        addresses = ", ".join(f"0x{util.hex32(address)}" for address in sym_db.get_addresses_from_symbol(symbol))
+        print(f"Duplicate symbol {symbol}: {addresses}")
+
+def print_demangle_stats(sym_db):
+    stats = sym_db.get_demangle_stats()
+
+    rows = [
+        ("Cached names", stats["entries"]),
+        ("Hits", stats["hits"]),
+        ("Failed hits", stats["failed_hits"]),
+        ("Misses", stats["misses"]),
+        ("Hit rate", f"{stats['hit_rate'] * 100:.1f}%")
+    ]
+
+    print()
+    util.print_table(("Demangle cache", "Value"), rows)
+
+def run_batch(sym_db, args):
+    global is_batch_mode
+
+    is_transaction = "--transaction" in args
+    args = [arg for arg in args if arg != "--transaction"]
+
+    if len(args) != 1:
+        print_help_and_exit()
+
+    if args[0] == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(args[0], "r") as input:
+            lines = input.read().splitlines()
+
+    errors = []
+    command_count = 0
+
+    is_batch_mode = True
+
+    try:
+        for line_nr, line in enumerate(lines, 1):
+            line = line.strip()
+
+            if not line or line.startswith("#"):
+                continue
+
+            command_count += 1
+
+            print(f"> {line}")
+
+            try:
+                # shlex raises ValueError for unclosed quotes
+                command_args = shlex.split(line)
+                command = command_args[0]
+
+                if command not in COMMANDS or command in { "batch", "compact" }:
+                    raise UsageError(f"Invalid command: {command}")
+
+                COMMANDS[command](sym_db, command_args[1:])
+            except (UsageError, ValueError, KeyError, AssertionError, OSError) as e:
+                print(f"Error on line {line_nr}: {e}")
+                errors.append((line_nr, line, str(e)))
+
+                if is_transaction:
+                    break
+
+            print()
+    finally:
+        is_batch_mode = False
+
+    if len(errors) > 0:
+        util.print_table(("Line", "Command", "Error"), errors)
+        print()
+
+    if is_transaction and len(errors) > 0:
+        # Drop every change made by the batch
+        sym_db.load()
+        print("The batch was rolled back.")
+        return
+
+    print(f"{command_count - len(errors)} of {command_count} command(s) succeeded.")
+
+COMMANDS = {
+    "batch": run_batch,
+    "compact": compact,
+    "func": func_info,
+    "find": find_symbol,
+    "gen-map": gen_map,
+    "list-lib": list_libs,
+    "list-obj": list_objs,
+    "list-func": list_func,
+    "move": move_func,
+    "move-multi": move_multi_func,
+    "rand-func": random_func,
+    "rand-obj": random_obj,
+    "rename-obj": rename_obj,
+    "search-func": search_func,
+    "set-symbol": set_symbol,
+    "set-size": set_size,
+    "tree": tree,
+    "unmark": unmark_func,
+    "unset-symbol": unset_symbol,
+    "validate": validate
+}
+
 def main(args):
+    show_stats = "--stats" in args
+
+    if show_stats:
+        args = [arg for arg in args if arg != "--stats"]
+
     if len(args) < 1:
         print_help_and_exit()
 
-    sym_db = SymbolDB()
-    sym_db.load()
-
     command = args[0]
     rest = args[1:]
 
     if command == "help":
         print_help_and_exit()
-    elif command == "func":
-        func_info(sym_db, rest)
-    elif command == "gen-map":
-        gen_map(sym_db, rest)
-    elif command == "list-lib":
-        list_libs(sym_db, rest)
-    elif command == "list-obj":
-        list_objs(sym_db, rest)
-    elif command == "list-func":
-        list_func(sym_db, rest)
-    elif command == "move":
-        move_func(sym_db, rest)
-    elif command == "move-multi":
-        move_multi_func(sym_db, rest)
-    elif command == "rand-func":
-        random_func(sym_db, rest)
-    elif command == "rand-obj":
-        random_obj(sym_db, rest)
-    elif command == "rename-obj":
-        rename_obj(sym_db, rest)
-    elif command == "search-func":
-        search_func(sym_db, rest)
-    elif command == "set-symbol":
-        set_symbol(sym_db, rest)
-    elif command == "set-size":
-        set_size(sym_db, rest)
-    elif command == "tree":
-        tree(sym_db, rest)
-    elif command == "unmark":
-        unmark_func(sym_db, rest)
-    elif command == "unset-symbol":
-        unset_symbol(sym_db, rest)
-    elif command == "validate":
-        validate(sym_db, rest)
-    else:
+
+    if not command in COMMANDS:
         print(f"Invalid command: {command}")
         print()
         print_help_and_exit()
 
+    sym_db = SymbolDB()
+    sym_db.load()
+
+    COMMANDS[command](sym_db, rest)
+
     sym_db.save()
 
+    if show_stats:
+        print_demangle_stats(sym_db)
+
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,178 @@
+import demangler
+import hashlib
+import os
+import pickle
+
+# Bump when the layout of the cache file changes
+CACHE_VERSION = 3
+
+def get_demangler_hash():
+    # Any change to the demangler invalidates every cached result
+    with open(demangler.__file__, "rb") as input:
+        return hashlib.sha1(input.read()).hexdigest()
+
+class DemangleCache:
+    # Demangled strings are kept apart from the demangler.DemangledSymbol
+    # trees, which are only unpickled once a tree is asked for
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.entries = dict()
+        self.trees = None
+        self.tree_data = None
+        self.new_trees = dict()
+        self.invalidated = set()
+        self.is_loaded = False
+        self.is_dirty = False
+
+        self.hits = 0
+        self.misses = 0
+        self.failed_hits = 0
+
+    def load(self):
+        self.entries.clear()
+        self.trees = None
+        self.tree_data = None
+        self.new_trees.clear()
+        self.invalidated.clear()
+        self.is_loaded = True
+
+        try:
+            with open(self.file_name, "rb") as input:
+                cache = pickle.load(input)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+
+        if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+            return
+
+        if cache["demangler"] != get_demangler_hash():
+            return
+
+        self.entries = cache["entries"]
+        self.tree_data = cache["trees"]
+
+    def _get_trees(self):
+        if self.trees is None:
+            self.trees = pickle.loads(self.tree_data) if self.tree_data is not None else dict()
+
+            for mangled in self.invalidated:
+                self.trees.pop(mangled, None)
+
+            self.trees.update(self.new_trees)
+            self.new_trees.clear()
+
+        return self.trees
+
+    def save(self):
+        if not self.is_dirty:
+            return
+
+        if self.trees is None and len(self.new_trees) == 0 and len(self.invalidated) == 0:
+            tree_data = self.tree_data
+        else:
+            tree_data = pickle.dumps(self._get_trees(), pickle.HIGHEST_PROTOCOL)
+
+        cache = {
+            "version": CACHE_VERSION,
+            "demangler": get_demangler_hash(),
+            "entries": self.entries,
+            "trees": tree_data
+        }
+
+        temp_file_name = self.file_name.with_name(self.file_name.name + ".tmp")
+
+        try:
+            with open(temp_file_name, "wb") as output:
+                pickle.dump(cache, output, pickle.HIGHEST_PROTOCOL)
+
+            os.replace(temp_file_name, self.file_name)
+        except OSError:
+            pass
+
+        self.tree_data = tree_data
+        self.invalidated.clear()
+        self.is_dirty = False
+
+    def _lookup(self, mangled):
+        # Returns True if the name is cached, raises if it is cached as failed
+        if not self.is_loaded:
+            self.load()
+
+        if not mangled in self.entries:
+            return False
+
+        if self.entries[mangled] is None:
+            self.failed_hits += 1
+            raise demangler.DemanglerException(f"Error! Failed to demangle {mangled}")
+
+        self.hits += 1
+
+        return True
+
+    def _demangle_new(self, mangled):
+        self.misses += 1
+        self.is_dirty = True
+
+        # Failures are cached as None so that bad names are not retried
+        try:
+            tree = demangler.demangle_symbol_tree(mangled)
+        except demangler.DemanglerException:
+            self.entries[mangled] = None
+            raise
+
+        self.entries[mangled] = tree.to_string()
+
+        if self.trees is None:
+            self.new_trees[mangled] = tree
+        else:
+            self.trees[mangled] = tree
+
+        return tree
+
+    def demangle(self, mangled):
+        if self._lookup(mangled):
+            return self.entries[mangled]
+
+        return self._demangle_new(mangled).to_string()
+
+    def demangle_tree(self, mangled):
+        if self._lookup(mangled):
+            tree = self.new_trees.get(mangled)
+
+            if tree is None:
+                tree = self._get_trees().get(mangled)
+
+            if tree is not None:
+                return tree
+
+            # Only the string was cached, e.g. by an older tree-less run
+            self.hits -= 1
+
+        return self._demangle_new(mangled)
+
+    def invalidate(self, mangled):
+        if not self.is_loaded:
+            self.load()
+
+        if mangled in self.entries:
+            del self.entries[mangled]
+            self.new_trees.pop(mangled, None)
+
+            if self.trees is None:
+                self.invalidated.add(mangled)
+            else:
+                self.trees.pop(mangled, None)
+
+            self.is_dirty = True
+
+    def get_stats(self):
+        lookups = self.hits + self.failed_hits + self.misses
+        hit_rate = (self.hits + self.failed_hits) / lookups if lookups > 0 else 0.0
+
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "failed_hits": self.failed_hits,
+            "misses": self.misses,
+            "hit_rate": hit_rate
+        }
@@ -1,6 +1,13 @@
+import collections
+import concurrent.futures
+import functools
+import os
 import sys
 import util
 
+# Maximum number of entries in each of the fragment caches
+FRAGMENT_CACHE_SIZE = 8192
+
 SPECIAL_NAME_TABLE = {
     "__pl": "operator+",
     "__mi": "operator-",
@@ -71,6 +78,223 @@ NODE_SUFFIXES = {
 class DemanglerException(Exception):
     pass
 
+# Kinds of demangled symbols
+SYMBOL_PLAIN = "plain"
+SYMBOL_DATA = "data"
+SYMBOL_FUNCTION = "function"
+SYMBOL_CONSTRUCTOR = "constructor"
+SYMBOL_DESTRUCTOR = "destructor"
+SYMBOL_OPERATOR = "operator"
+SYMBOL_VTABLE = "vtable"
+
+class Node:
+    # Nodes are shared between symbols through the fragment caches, so they
+    # must not be changed once created. The rendered string is kept.
+    __slots__ = ("text",)
+
+    def __init__(self):
+        self.text = None
+
+    def to_string(self):
+        if self.text is None:
+            self.text = self.render()
+
+        return self.text
+
+    def __str__(self):
+        return self.to_string()
+
+class IntegralNode(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+    def render(self):
+        return self.value
+
+class Name(Node):
+    # template_args is None for names without a template argument list
+    __slots__ = ("identifier", "template_args")
+
+    def __init__(self, identifier, template_args=None):
+        super().__init__()
+        self.identifier = identifier
+        self.template_args = template_args
+
+    def render(self):
+        if self.template_args is None:
+            return self.identifier
+
+        args_str = ", ".join(arg.to_string() for arg in self.template_args)
+
+        return f"{self.identifier}<{args_str}>"
+
+class QualifiedName(Node):
+    __slots__ = ("components",)
+
+    def __init__(self, components):
+        super().__init__()
+        self.components = components
+
+    def render(self):
+        return "::".join(component.to_string() for component in self.components)
+
+class PrimitiveType(Node):
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def render(self):
+        return self.name
+
+class ArrayType(Node):
+    __slots__ = ("element", "count")
+
+    def __init__(self, element, count):
+        super().__init__()
+        self.element = element
+        self.count = count
+
+    def render(self):
+        return f"{self.element.to_string()}[{self.count}]"
+
+class FunctionType(Node):
+    __slots__ = ("parameters", "return_type")
+
+    def __init__(self, parameters, return_type):
+        super().__init__()
+        self.parameters = parameters
+        self.return_type = return_type
+
+    def render(self):
+        result = ""
+
+        if self.return_type is not None:
+            result += f"{self.return_type.to_string()} "
+
+        args_str = ", ".join(arg.to_string() for arg in self.parameters)
+        result += f"()({args_str})"
+
+        return result
+
+class MemberFunctionPointerType(Node):
+    __slots__ = ("class_type", "parameters", "return_type", "is_const")
+
+    def __init__(self, class_type, parameters, return_type, is_const):
+        super().__init__()
+        self.class_type = class_type
+        self.parameters = parameters
+        self.return_type = return_type
+        self.is_const = is_const
+
+    def render(self):
+        result = ""
+
+        if self.return_type is not None:
+            result += f"{self.return_type.to_string()} "
+
+        args_str = ", ".join(arg.to_string() for arg in self.parameters)
+        result += f"({self.class_type.to_string()}::*)({args_str})"
+
+        if self.is_const:
+            result += " const"
+
+        return result
+
+class ModifiedType(Node):
+    # qualifiers are const/unsigned/signed written before the base type,
+    # declarators are */& (and " const" for function types) written after it
+    __slots__ = ("base", "qualifiers", "declarators")
+
+    def __init__(self, base, qualifiers, declarators):
+        super().__init__()
+        self.base = base
+        self.qualifiers = qualifiers
+        self.declarators = declarators
+
+    def render(self):
+        result = ""
+
+        if len(self.qualifiers) > 0:
+            result += " ".join(self.qualifiers)
+            result += " "
+
+        result += self.base.to_string()
+        result += "".join(self.declarators)
+
+        return result
+
+class DemangledSymbol:
+    __slots__ = ("mangled", "kind", "namespace", "name", "parameters", "return_type", "is_const", "text")
+
+    def __init__(self, mangled):
+        self.mangled = mangled
+        self.kind = SYMBOL_PLAIN
+        self.namespace = None
+        self.name = None
+        self.parameters = None
+        self.return_type = None
+        self.is_const = False
+        self.text = None
+
+    def is_function(self):
+        return self.parameters is not None
+
+    def get_namespace_path(self):
+        if self.namespace is None:
+            return []
+
+        if isinstance(self.namespace, QualifiedName):
+            return [component.to_string() for component in self.namespace.components]
+
+        return [self.namespace.to_string()]
+
+    def get_display_name(self):
+        # The name with operators, constructors and destructors resolved
+        if self.kind == SYMBOL_PLAIN:
+            return self.mangled
+
+        namespace = self.namespace.to_string() if self.namespace is not None else None
+
+        return get_display_name(self.name, namespace)
+
+    def to_string(self):
+        if self.text is None:
+            self.text = self.render()
+
+        return self.text
+
+    def __str__(self):
+        return self.to_string()
+
+    def render(self):
+        if self.kind == SYMBOL_PLAIN:
+            return self.mangled
+
+        result = ""
+
+        if self.return_type is not None:
+            result += f"{self.return_type.to_string()} "
+
+        if self.namespace is not None:
+            result += f"{self.namespace.to_string()}::"
+
+        result += self.get_display_name()
+
+        if self.is_function():
+            result += "("
+            result += ", ".join(arg.to_string() for arg in self.parameters)
+            result += ")"
+
+            if self.is_const:
+                result += " const"
+
+        return result
+
 def is_integral(node):
     if not node:
         return False
@@ -89,193 +313,251 @@ def separate_template(node):
 
     return node[0:template_start], node[template_start:]
 
-def try_demangle_templates(node):
-    name, template = separate_template(node)
+def demangle_templates(symbol, start, end):
+    # Demangles the name in symbol[start:end] with its template arguments
+    template_start = symbol.find("<", start, end)
+
+    if template_start == -1:
+        return Name(symbol[start:end])
 
-    if not template:
-        return name
-    
     types = []
     level = 0
-    current_type = ""
+    type_start = template_start
+
+    for i in range(template_start, end):
+        c = symbol[i]
 
-    for c in template:                
         if c == "<":
             level += 1
 
             if level == 1:
+                type_start = i + 1
                 continue
 
         if c == ">":
             if level == 1:
-                types.append(current_type)
-                current_type = ""
+                types.append((type_start, i))
+                type_start = i + 1
                 continue
 
             level -= 1
 
         if c == "," and level == 1:
-            types.append(current_type)
-            current_type = ""
-            continue
- 
-        current_type += c            
+            types.append((type_start, i))
+            type_start = i + 1
+
+    template_args = []
+
+    for type_start, type_end in types:
+        type_name = symbol[type_start:type_end]
 
-    types_str = []
-    
-    for type_name in types:
         if is_integral(type_name):
-            types_str.append(type_name)
+            template_args.append(IntegralNode(type_name))
         else:
-            type_node, rest = demangle_node(type_name)
-            assert len(rest) == 0
+            type_node, pos = demangle_node(symbol, type_start, type_end)
+
+            if pos != type_end:
+                raise DemanglerException(f"Error! Invalid template argument: {type_name}")
+
+            template_args.append(type_node)
+
+    return Name(symbol[start:template_start], tuple(template_args))
+
+def try_demangle_templates(node):
+    return demangle_name_fragment(node).to_string()
+
+# Symbols share many fragments (class names, template argument lists,
+# qualified names and argument lists), so they are demangled once each
 
-            types_str.append(type_node)
+@functools.lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def demangle_name_fragment(fragment):
+    return demangle_templates(fragment, 0, len(fragment))
 
-    result = name
+@functools.lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def demangle_qualified_fragment(fragment):
+    node, pos = demangle_qualified(fragment, 0, len(fragment))
 
-    result += "<"
-    result += ", ".join(types_str)
-    result += ">"            
+    if pos != len(fragment):
+        raise DemanglerException(f"Error! Invalid qualified name: {fragment}")
 
-    return result
+    return node
 
-def demangle_func_args(rest):
+@functools.lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def demangle_func_args_fragment(fragment):
+    args, return_type, pos = demangle_func_args(fragment, 0, len(fragment))
+
+    return tuple(args), return_type, pos
+
+def get_cache_stats():
+    return {
+        "names": demangle_name_fragment.cache_info(),
+        "qualified names": demangle_qualified_fragment.cache_info(),
+        "argument lists": demangle_func_args_fragment.cache_info()
+    }
+
+def clear_caches():
+    demangle_name_fragment.cache_clear()
+    demangle_qualified_fragment.cache_clear()
+    demangle_func_args_fragment.cache_clear()
+
+def get_qualified_depth(symbol, pos, end):
+    if pos + 1 >= end or not symbol[pos + 1].isdigit():
+        raise DemanglerException(f"Error! Invalid qualified name: {symbol[pos:end]}")
+
+    return int(symbol[pos + 1])
+
+def get_qualified_end(symbol, pos, end):
+    # Returns the end of the qualified name starting at symbol[pos], or None
+    # if one of its components is not a plain length prefixed name
+    depth = get_qualified_depth(symbol, pos, end)
+    pos += 2
+
+    for _ in range(depth):
+        length_start = pos
+
+        while pos < end and symbol[pos].isdigit():
+            pos += 1
+
+        if pos == length_start:
+            return None
+
+        pos += int(symbol[length_start:pos])
+
+        if pos > end:
+            return None
+
+    return pos
+
+def demangle_qualified(symbol, pos, end):
+    depth = get_qualified_depth(symbol, pos, end)
+    pos += 2
+
+    components = []
+
+    for _ in range(depth):
+        inner_node, pos = demangle_node(symbol, pos, end)
+        components.append(inner_node)
+
+    return QualifiedName(tuple(components)), pos
+
+def demangle_func_args(symbol, pos, end):
     args = []
     return_type = None
 
-    while len(rest) > 0:
-        if rest[0] == "_":
-            rest = rest[1:]
-            return_type, rest = demangle_node(rest)
+    while pos < end:
+        if symbol[pos] == "_":
+            return_type, pos = demangle_node(symbol, pos + 1, end)
 
             break
 
-        arg, rest = demangle_node(rest)
+        arg, pos = demangle_node(symbol, pos, end)
         args.append(arg)
 
-    return args, return_type, rest
+    return args, return_type, pos
 
-def demangle_node(rest):
+def demangle_node(symbol, pos, end):
+    # Demangles the node starting at symbol[pos] and returns it together with
+    # the position after it. Function arguments never extend past end.
     pre = []
     post = []
 
     while True:
-        if rest[0] in NODE_PREFIXES:
-            pre.append(NODE_PREFIXES[rest[0]])
-        elif rest[0] in NODE_SUFFIXES:
-            post.append(NODE_SUFFIXES[rest[0]])
-        else:
-            break
-        
-        rest = rest[1:]
+        if pos >= end:
+            raise DemanglerException(f"Error! Unexpected end of symbol: {symbol}")
 
-    if rest[0] in PRIMITIVE_TYPES:
-        node = PRIMITIVE_TYPES[rest[0]]
-        rest = rest[1:]
-    elif rest[0] == "Q":
-        depth = int(rest[1])
-        rest = rest[2:]
+        c = symbol[pos]
 
-        components = []
+        if c in NODE_PREFIXES:
+            pre.append(NODE_PREFIXES[c])
+        elif c in NODE_SUFFIXES:
+            post.append(NODE_SUFFIXES[c])
+        else:
+            break
 
-        for _ in range(depth):
-            inner_node, rest = demangle_node(rest)
-            components.append(inner_node)
+        pos += 1
 
-        node = "::".join(components)
-    elif rest[0] == "A":
-        rest = rest[1:]
-        count_str = ""
+    c = symbol[pos]
 
-        while rest[0] != "_":
-            count_str += rest[0]
-            rest = rest[1:]
+    if c in PRIMITIVE_TYPES:
+        node = PrimitiveType(PRIMITIVE_TYPES[c])
+        pos += 1
+    elif c == "Q":
+        qualified_end = get_qualified_end(symbol, pos, end)
 
-        rest = rest[1:]
+        if qualified_end is None:
+            node, pos = demangle_qualified(symbol, pos, end)
+        else:
+            node = demangle_qualified_fragment(symbol[pos:qualified_end])
+            pos = qualified_end
+    elif c == "A":
+        count_end = symbol.find("_", pos + 1, end)
 
-        count = int(count_str)
-        type_name, rest = demangle_node(rest)
-        
-        node = f"{type_name}[{count}]"
-    elif rest[0] == "F":
-        rest = rest[1:]
+        if count_end == -1 or not is_integral(symbol[pos + 1:count_end]):
+            raise DemanglerException(f"Error! Invalid array: {symbol[pos:end]}")
 
-        args, return_type, rest = demangle_func_args(rest)
-        args_str = ", ".join(args)
+        count = int(symbol[pos + 1:count_end])
+        pos = count_end + 1
 
-        node = ""
+        type_node, pos = demangle_node(symbol, pos, end)
 
-        if return_type is not None:
-            node += f"{return_type} "
+        node = ArrayType(type_node, count)
+    elif c == "F":
+        args, return_type, pos = demangle_func_args(symbol, pos + 1, end)
 
-        node += f"()({args_str})"
+        node = FunctionType(tuple(args), return_type)
 
         if pre == ["const"]:
             pre = []
             post.append(" const")
 
-    elif rest[0] == "M":
-        rest = rest[1:]
-        namespace, rest = demangle_node(rest)
+    elif c == "M":
+        class_type, pos = demangle_node(symbol, pos + 1, end)
         is_const_func = False
-        
-        if rest[0] == "C":
+
+        if pos < end and symbol[pos] == "C":
             is_const_func = True
-            rest = rest[1:]
+            pos += 1
 
-        if rest[0] != "F":
+        if pos >= end or symbol[pos] != "F":
             raise DemanglerException("Error! Expection F after member.")
 
-        rest = rest[1:]
-
-        args, return_type, rest = demangle_func_args(rest)
-        args_str = ", ".join(args)
+        args, return_type, pos = demangle_func_args(symbol, pos + 1, end)
 
-        node = ""
+        node = MemberFunctionPointerType(class_type, tuple(args), return_type, is_const_func)
+    elif c.isdigit():
+        length_start = pos
 
-        if return_type is not None:
-            node += f"{return_type} "
+        while pos < end and symbol[pos].isdigit():
+            pos += 1
 
-        node += f"({namespace}::*)({args_str})"
+        if pos == end:
+            raise DemanglerException(f"Error! Missing name: {symbol[length_start:end]}")
 
-        if is_const_func:
-            node += " const"
-    elif rest[0].isdigit():
-        node_length_str = ""
+        node_length = int(symbol[length_start:pos])
+        node_end = min(pos + node_length, end)
 
-        while rest[0].isdigit():
-            node_length_str += rest[0]
-            rest = rest[1:]
-
-        node_length = int(node_length_str)
-        node = rest[0:node_length]
-        node = try_demangle_templates(node)
-
-        rest = rest[node_length:]
+        node = demangle_name_fragment(symbol[pos:node_end])
+        pos = node_end
     else:
-        raise DemanglerException(f"Error! Invalid node: {rest}")
-        
-    result = ""
+        raise DemanglerException(f"Error! Invalid node: {symbol[pos:end]}")
 
-    if len(pre) > 0:
-        result += " ".join(pre)
-        result += " "
+    if len(pre) > 0 or len(post) > 0:
+        node = ModifiedType(node, tuple(pre), tuple(post))
 
-    result += node
+    return node, pos
 
-    if len(post) > 0:
-        result += "".join(post)
+def get_display_name(name, namespace):
+    # name is the Name node of the symbol and namespace the demangled
+    # namespace string, which is needed for constructors and destructors
+    identifier = name.identifier
+    template = name.to_string()[len(identifier):]
 
-    return result, rest
+    if identifier in SPECIAL_NAME_TABLE:
+        identifier = SPECIAL_NAME_TABLE[identifier]
+    elif identifier in { "__ct", "__dt" }:
+        if namespace is None:
+            raise DemanglerException(f"Error! Missing class of {identifier}.")
 
-def demangle_name(name, namespace):
-    name = try_demangle_templates(name)
-    name, template = separate_template(name)
-    
-    if name in SPECIAL_NAME_TABLE:
-        name = SPECIAL_NAME_TABLE[name]
-    elif name in { "__ct", "__dt" }:
         class_index = namespace.rfind("::")
 
         if class_index == -1:
@@ -285,66 +567,207 @@ def demangle_name(name, namespace):
             
         class_name, _ = separate_template(class_name)
 
-        if name == "__ct":
-            name = class_name
-        elif name == "__dt":
-            name = f"~{class_name}"
+        if identifier == "__ct":
+            identifier = class_name
+        elif identifier == "__dt":
+            identifier = f"~{class_name}"
 
-    return f"{name}{template}"
+    return f"{identifier}{template}"
 
-def demangle_symbol(symbol):
+def demangle_name(name, namespace):
+    return get_display_name(demangle_name_fragment(name), namespace)
+
+def get_symbol_kind(identifier, has_func):
+    if identifier == "__vt":
+        return SYMBOL_VTABLE
+
+    if identifier in SPECIAL_NAME_TABLE:
+        return SYMBOL_OPERATOR
+
+    if identifier == "__ct":
+        return SYMBOL_CONSTRUCTOR
+
+    if identifier == "__dt":
+        return SYMBOL_DESTRUCTOR
+
+    if has_func:
+        return SYMBOL_FUNCTION
+
+    return SYMBOL_DATA
+
+def demangle_symbol_tree(symbol):
+    tree = DemangledSymbol(symbol)
     name_end = symbol.rfind("__")
 
     if name_end <= 0:
-        return symbol
+        return tree
 
-    name_mangled = symbol[0:name_end]
-    rest = symbol[name_end + 2:]
+    pos = name_end + 2
+    end = len(symbol)
 
-    is_const_func = False
     has_func = False
-    namespace = None
 
-    while len(rest) > 0:
-        if rest[0] == "F":
+    while pos < end:
+        c = symbol[pos]
+
+        if c == "F":
             has_func = True
-            rest = rest[1:]
+            pos += 1
             break
-        elif rest[0] == "C":
-            is_const_func = True
-            rest = rest[1:]
+        elif c == "C":
+            tree.is_const = True
+            pos += 1
         else:
-            namespace, rest = demangle_node(rest)
-
-    arguments = []
-    return_type = None
+            tree.namespace, pos = demangle_node(symbol, pos, end)
 
     if has_func:
-        arguments, return_type, rest = demangle_func_args(rest)
-        assert len(rest) == 0
+        tree.parameters, tree.return_type, length = demangle_func_args_fragment(symbol[pos:])
 
-    result = ""
+        if pos + length != end:
+            raise DemanglerException(f"Error! Invalid arguments: {symbol[pos:]}")
 
-    if return_type is not None:
-        result += f"{return_type} "
+    tree.name = demangle_name_fragment(symbol[0:name_end])
+    tree.kind = get_symbol_kind(tree.name.identifier, has_func)
 
-    if namespace is not None:
-        result += f"{namespace}::"
+    # Check the name the same way as before the tree existed, e.g. that
+    # constructors and destructors have a namespace
+    tree.to_string()
 
-    result += demangle_name(name_mangled, namespace)
+    return tree
 
-    if has_func:
-        result += "("
-        result += ", ".join(arguments)
-        result += ")"
+def demangle_symbol(symbol):
+    return demangle_symbol_tree(symbol).to_string()
 
-        if is_const_func:
-            result += " const"
+def demangle_chunk(symbols):
+    # Returns (demangled, error) for each symbol, where exactly one is None
+    results = []
+
+    for symbol in symbols:
+        try:
+            results.append((demangle_symbol(symbol), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+
+    return results
+
+def read_chunks(input, chunk_size):
+    chunk = []
+
+    for line in input:
+        chunk.append(line.strip())
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+def demangle_stream(input, output, jobs, chunk_size):
+    # Demangles one name per line in chunks across a process pool. Results are
+    # written in input order. Names that fail are written as is and reported
+    # on stderr.
+    line_nr = 0
+    failed_count = 0
+
+    def write_results(chunk, results):
+        nonlocal line_nr, failed_count
+
+        lines = []
+
+        for symbol, (demangled, error) in zip(chunk, results):
+            line_nr += 1
+
+            if error is not None:
+                failed_count += 1
+                print(f"Failed to demangle \"{symbol}\" on line {line_nr}: {error}", file=sys.stderr)
+                demangled = symbol
+
+            lines.append(demangled)
+            lines.append("\n")
+
+        output.write("".join(lines))
 
-    return result
+    chunks = read_chunks(input, chunk_size)
+
+    if jobs <= 1:
+        for chunk in chunks:
+            write_results(chunk, demangle_chunk(chunk))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Only keep a few chunks in flight so memory stays bounded
+            pending = collections.deque()
+
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(demangle_chunk, chunk)))
+
+                if len(pending) >= jobs * 2:
+                    chunk, future = pending.popleft()
+                    write_results(chunk, future.result())
+
+            while len(pending) > 0:
+                chunk, future = pending.popleft()
+                write_results(chunk, future.result())
+
+    output.flush()
+
+    return failed_count
+
+def print_help_and_exit():
+    print("Usage: demangler.py <symbol>...")
+    print("       demangler.py --stdin [--jobs <n>] [--chunk-size <n>]")
+    print("       demangler.py --file <path> [--jobs <n>] [--chunk-size <n>]")
+    print("       demangler.py --test")
+    sys.exit()
 
 def main(args):
-    for symbol in args:
+    input_file_name = None
+    use_stdin = False
+    jobs = os.cpu_count() or 1
+    chunk_size = 1000
+    symbols = []
+
+    i = 0
+
+    while i < len(args):
+        arg = args[i]
+
+        if arg == "--stdin":
+            use_stdin = True
+        elif arg in { "--file", "--jobs", "--chunk-size" }:
+            if i + 1 >= len(args):
+                print_help_and_exit()
+
+            value = args[i + 1]
+            i += 1
+
+            if arg == "--file":
+                input_file_name = value
+            elif arg == "--jobs":
+                jobs = int(value)
+            else:
+                chunk_size = max(int(value), 1)
+        else:
+            symbols.append(arg)
+
+        i += 1
+
+    if use_stdin or input_file_name is not None:
+        if len(symbols) > 0:
+            print_help_and_exit()
+
+        if use_stdin:
+            failed_count = demangle_stream(sys.stdin, sys.stdout, jobs, chunk_size)
+        else:
+            with open(input_file_name, "r") as input:
+                failed_count = demangle_stream(input, sys.stdout, jobs, chunk_size)
+
+        if failed_count > 0:
+            print(f"{failed_count} name(s) failed to demangle.", file=sys.stderr)
+
+        return
+
+    for symbol in symbols:
         demangled = demangle_symbol(symbol)
         print(demangled)
 
@@ -368,6 +791,16 @@ def run_tests():
         "sCameraTable__12CameraHolder":                                                             "CameraHolder::sCameraTable"
     }
 
+    # Malformed names have to fail with DemanglerException
+    INVALID_TESTS = [
+        "IsCompletelyOnScreen__Q10CPatternedCFRC13CStateManager",
+        "SetRelRotation__QCSkelPoseFiRC11CQuaternion",
+        "Magnitude__9CVector2fCQ",
+        "GetDuration__11CMayaSplineCFv1",
+        "makeMtxRotate__2MRFPA4ffff",
+        "__ct__Fv"
+    ]
+
     result = []
     
     for value, expected in TESTS.items():
@@ -375,6 +808,14 @@ def run_tests():
 
         result.append([expected, demangled, expected == demangled])
 
+    for value in INVALID_TESTS:
+        try:
+            demangled = demangle_symbol(value)
+        except DemanglerException:
+            demangled = "DemanglerException"
+
+        result.append(["DemanglerException", demangled, demangled == "DemanglerException"])
+
     util.print_table(["Expected", "Actual", "Passed"], result)
     
 if __name__ == "__main__":
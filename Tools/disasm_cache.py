@@ -0,0 +1,108 @@
+import asm
+import hashlib
+import os
+import pickle
+import util
+from array import array
+
+CACHE_FILE_NAME = util.ROOT_PATH / "Disassembly.cache"
+
+# Bump when the layout of the cache file changes
+CACHE_VERSION = 2
+
+def get_decoder_hash():
+    # The decoded branches only depend on asm
+    with open(asm.__file__, "rb") as input:
+        return hashlib.sha1(input.read()).hexdigest()
+
+def get_dol_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+class DisasmCache:
+    # The branches from asm.find_branches for each code range, keyed by the
+    # range's (address, size). The sources, targets and kinds are kept as
+    # arrays, which pickle as raw bytes.
+    def __init__(self, file_name=CACHE_FILE_NAME):
+        self.file_name = file_name
+        self.dol_hash = None
+        self.entries = dict()
+        self.used = set()
+        self.is_dirty = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, dol_hash):
+        # Anything cached for another DOL or decoder is dropped
+        self.dol_hash = dol_hash
+        self.entries.clear()
+        self.used.clear()
+
+        try:
+            with open(self.file_name, "rb") as input:
+                cache = pickle.load(input)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+
+        if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+            return
+
+        if cache["dol"] != dol_hash or cache["decoder"] != get_decoder_hash():
+            return
+
+        self.entries = cache["entries"]
+
+    def save(self):
+        # Ranges that changed since the last run are not used anymore, so
+        # only the ones used by this run are kept
+        if not self.is_dirty and len(self.used) == len(self.entries):
+            return
+
+        cache = {
+            "version": CACHE_VERSION,
+            "dol": self.dol_hash,
+            "decoder": get_decoder_hash(),
+            "entries": { key: self.entries[key] for key in self.used }
+        }
+
+        temp_file_name = self.file_name.with_name(self.file_name.name + ".tmp")
+
+        try:
+            with open(temp_file_name, "wb") as output:
+                pickle.dump(cache, output, pickle.HIGHEST_PROTOCOL)
+
+            os.replace(temp_file_name, self.file_name)
+        except OSError:
+            pass
+
+        self.is_dirty = False
+
+    def find_branches(self, data, address):
+        # Same branches as asm.find_branches for the range at address
+        key = (address, len(data))
+        branches = self.entries.get(key)
+        self.used.add(key)
+
+        if branches is None:
+            self.misses += 1
+            self.is_dirty = True
+
+            sources, targets, kinds = asm.find_branches(data, address)
+            branches = (array("I", sources.tolist()), array("I", targets.tolist()), array("B", kinds.tolist()))
+
+            self.entries[key] = branches
+        else:
+            self.hits += 1
+
+        return branches
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": hit_rate
+        }
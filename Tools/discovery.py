@@ -0,0 +1,427 @@
+import asm
+import bisect
+import concurrent.futures
+import db
+import disasm_cache
+import dol
+import os
+import padding_index
+import struct
+import sys
+import time
+import util
+
+# Functions only follow each other directly, without padding, when the
+# first one ends on this alignment
+FUNCTION_ALIGNMENT = 0x10
+
+# Shards per job, more shards balance the work better between processes
+SHARDS_PER_JOB = 4
+
+class Change:
+    def __init__(self, address, old_size, new_size):
+        self.address = address
+        self.old_size = old_size
+        self.new_size = new_size
+
+    def is_new(self):
+        return self.old_size is None
+
+class CodeRange:
+    # The decoded code of a section, or of a shard of it. Functions are found
+    # in one pass over it:
+    #
+    # - Every known function, every bl target and the first instruction after
+    #   every padding is the start of a function.
+    # - A function ends at the next start or padding, or at a blr once no
+    #   branch inside the function goes past it. Unless the function ends
+    #   right before the next start or padding, the blr also has to be
+    #   followed by an aligned address, which starts the next function.
+    #
+    # Fixed functions (decompiled functions and other symbols) are kept as
+    # they are. branches are the arrays from asm.find_branches for the range.
+    def __init__(self, data, address, branches):
+        count = len(data) // 4
+
+        self.address = address
+        self.end = address + count * 4
+        self.words = struct.unpack(f">{count}I", data[:count * 4])
+        self.padding = padding_index.PaddingIndex(dol.get_words(data, 0, count), address)
+
+        sources, targets, kinds = branches
+
+        self.branch_sources = sources.tolist()
+        self.branch_targets = targets.tolist()
+        self.branch_kinds = kinds.tolist()
+        self.branch_index = 0
+
+    def is_code(self, address):
+        return address % 4 == 0 and self.address <= address < self.end and self.words[(address - self.address) // 4] != 0
+
+    def get_call_targets(self):
+        return sorted({ target for target, kind in zip(self.branch_targets, self.branch_kinds) if kind == asm.BRANCH_BL })
+
+    def get_starts(self, known, calls):
+        starts = set(known)
+
+        for target in calls:
+            if self.is_code(target):
+                starts.add(target)
+
+        # Linear sweep, code after padding
+        if self.is_code(self.address):
+            starts.add(self.address)
+
+        for end in self.padding.ends:
+            if end < self.end:
+                starts.add(end)
+
+        return sorted(starts)
+
+    def find_sizes(self, starts, fixed, fixed_end):
+        # Starts and branches are both walked in address order, so every
+        # branch is only looked at once. fixed_end is the end of the fixed
+        # functions before the range.
+        sizes = dict()
+        self.branch_index = 0
+
+        for i, start in enumerate(starts):
+            next_start = starts[i + 1] if i + 1 < len(starts) else self.end
+
+            if start in fixed:
+                fixed_end = max(fixed_end, start + fixed[start])
+                continue
+
+            # Calls into the middle of a fixed function are left alone
+            if start < fixed_end or not self.is_code(start):
+                continue
+
+            address = start
+
+            while address is not None:
+                address = self._find_size(address, next_start, sizes)
+
+        return sizes
+
+    def _find_size(self, address, next_start, sizes):
+        # Sizes the function at address and returns the start of the function
+        # following it directly, if any
+        bound = min(next_start, self.padding.get_next_padding(address + 4))
+        end = bound
+        max_target = 0
+
+        sources = self.branch_sources
+        index = self.branch_index
+
+        while index < len(sources) and sources[index] < address:
+            index += 1
+
+        while index < len(sources) and sources[index] < bound:
+            source = sources[index]
+            kind = self.branch_kinds[index]
+            index += 1
+
+            if kind == asm.BRANCH_BLR:
+                if max_target <= source and (source + 4 == bound or (source + 4) % FUNCTION_ALIGNMENT == 0):
+                    end = source + 4
+                    break
+            elif kind != asm.BRANCH_BL:
+                target = self.branch_targets[index - 1]
+
+                if address <= target < bound:
+                    max_target = max(max_target, target)
+
+        self.branch_index = index
+        sizes[address] = end - address
+
+        return end if end < bound else None
+
+def discover_shard(data, address, branches, known, calls, fixed, fixed_end):
+    # Finds the functions in a shard, which has to start and end at padding.
+    # Also returns the starts that were used, the calls out of the shard and
+    # the time of each phase. Runs in the worker processes.
+    timings = []
+    start = time.perf_counter()
+
+    code = CodeRange(data, address, branches)
+    call_targets = code.get_call_targets()
+    timings.append(("Decode", time.perf_counter() - start))
+    start = time.perf_counter()
+
+    starts = code.get_starts(known, call_targets + calls)
+    timings.append(("Seed", time.perf_counter() - start))
+    start = time.perf_counter()
+
+    sizes = code.find_sizes(starts, fixed, fixed_end)
+    timings.append(("Size", time.perf_counter() - start))
+
+    external_calls = [target for target in call_targets if target < code.address or target >= code.end]
+
+    return sizes, starts, external_calls, timings
+
+class Shard:
+    def __init__(self, address, end):
+        self.address = address
+        self.end = end
+        self.known = []
+        self.fixed = dict()
+        self.fixed_end = 0
+        self.calls = []
+        self.result = None
+
+class Discovery:
+    # Finds the functions of a code section. With more than one job, the
+    # section is split at padding into shards which are searched in a
+    # process pool. Every shard reports its calls into the other shards, and
+    # a shard is searched again if it wasn't given all the calls into it.
+    # The result is the same as with a single job. The branches of the
+    # section are decoded once, through the cache if there is one.
+    def __init__(self, main_dol, sym_db, section_name=".text1", jobs=1, cache=None):
+        self.main_dol = main_dol
+        self.sym_db = sym_db
+        self.section = main_dol.get_section(section_name)
+        self.jobs = jobs
+        self.cache = cache
+
+        self.branches = None
+        self.shards = []
+        self.sizes = dict()
+        self.changes = []
+        self.timings = []
+
+    def _measure(self, name, func):
+        start = time.perf_counter()
+        func()
+        self.timings.append((name, time.perf_counter() - start))
+
+    def run(self):
+        self._measure("Branches", self.find_branches)
+
+        if self.jobs <= 1:
+            self.shards = [Shard(self.section.address, self.section.end)]
+            self._add_symbols()
+            self._discover_serial()
+        else:
+            self._measure("Split", self.split)
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                self._measure("Shards", lambda: self._discover_shards(executor))
+                self._measure("Reconcile", lambda: self._reconcile(executor))
+
+        self._measure("Diff", self.find_changes)
+
+        return self.changes
+
+    def find_branches(self):
+        view = self.main_dol.get_view(self.section)
+
+        if self.cache is not None:
+            self.branches = self.cache.find_branches(view, self.section.address)
+        else:
+            self.branches = asm.find_branches(view, self.section.address)
+
+    def split(self):
+        # About SHARDS_PER_JOB shards per job, each starting right after
+        # padding so no function crosses two shards
+        section = self.section
+        padding = padding_index.PaddingIndex(self.main_dol.get_words(section), section.address)
+        shard_count = self.jobs * SHARDS_PER_JOB
+
+        boundaries = [section.address]
+
+        for i in range(1, shard_count):
+            target = section.address + section.size * i // shard_count
+            index = bisect.bisect_left(padding.ends, target)
+
+            if index < len(padding.ends) and padding.ends[index] > boundaries[-1] and padding.ends[index] < section.end:
+                boundaries.append(padding.ends[index])
+
+        boundaries.append(section.end)
+
+        self.shards = [Shard(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+        self._add_symbols()
+
+        # Giving each shard the calls into it up front means it is rarely
+        # searched again
+        sources, targets, kinds = self.branches
+        calls = sorted({ target for target, kind in zip(targets.tolist(), kinds.tolist()) if kind == asm.BRANCH_BL })
+
+        for shard, shard_calls in zip(self.shards, self._group_by_shard(calls)):
+            shard.calls = sorted(shard_calls)
+
+    def _group_by_shard(self, addresses):
+        shard_addresses = [shard.address for shard in self.shards]
+        groups = [set() for shard in self.shards]
+
+        for address in addresses:
+            index = bisect.bisect_right(shard_addresses, address) - 1
+
+            if index >= 0 and address < self.shards[index].end:
+                groups[index].add(address)
+
+        return groups
+
+    def _add_symbols(self):
+        # Gives each shard everything discover_shard needs to know about the
+        # symbol database
+        fixed_end = 0
+
+        for shard in self.shards:
+            shard.known = self.sym_db.get_addresses_in_range(shard.address, shard.end)
+            shard.fixed_end = fixed_end
+
+            for address in shard.known:
+                if self.sym_db.is_marked_decompiled(address) or self.sym_db.get_sym_type(address) != "F":
+                    shard.fixed[address] = self.sym_db.get_size(address)
+                    fixed_end = max(fixed_end, address + shard.fixed[address])
+
+    def _get_shard_args(self, shard):
+        view = self.main_dol.get_view(self.section)
+        data = view[shard.address - self.section.address:shard.end - self.section.address]
+
+        # The branches of the shard, the sources are sorted
+        sources = self.branches[0]
+        first = bisect.bisect_left(sources, shard.address)
+        last = bisect.bisect_left(sources, shard.end)
+        branches = tuple(values[first:last] for values in self.branches)
+
+        return data, shard.address, branches, shard.known, shard.calls, shard.fixed, shard.fixed_end
+
+    def _discover_serial(self):
+        shard = self.shards[0]
+        shard.result = discover_shard(*self._get_shard_args(shard))
+
+        self.timings.extend(shard.result[3])
+        self.sizes = shard.result[0]
+
+    def _run_shards(self, executor, shards):
+        # Views can't be sent to other processes
+        args = [(data.tobytes(), *rest) for data, *rest in map(self._get_shard_args, shards)]
+
+        for shard, result in zip(shards, executor.map(discover_shard, *zip(*args))):
+            shard.result = result
+
+    def _discover_shards(self, executor):
+        self._run_shards(executor, self.shards)
+
+    def _reconcile(self, executor):
+        # Gives every shard the calls into it from the other shards, and
+        # searches the ones that weren't given all of them again
+        external_calls = []
+
+        for shard in self.shards:
+            external_calls.extend(shard.result[2])
+
+        changed = []
+
+        for shard, calls in zip(self.shards, self._group_by_shard(external_calls)):
+            if not calls.issubset(shard.calls):
+                shard.calls = sorted(calls.union(shard.calls))
+                changed.append(shard)
+
+        if len(changed) > 0:
+            self._run_shards(executor, changed)
+
+        self.sizes = dict()
+
+        for shard in self.shards:
+            self.sizes.update(shard.result[0])
+
+    def find_changes(self):
+        self.changes = []
+
+        for address in sorted(self.sizes):
+            size = self.sizes[address]
+
+            if not self.sym_db.does_address_exist(address):
+                self.changes.append(Change(address, None, size))
+            elif self.sym_db.get_size(address) != size:
+                self.changes.append(Change(address, self.sym_db.get_size(address), size))
+
+    def apply(self):
+        def apply_changes():
+            for change in self.changes:
+                if change.is_new():
+                    self.sym_db.add_function(change.address, change.new_size)
+                else:
+                    self.sym_db.set_size(change.address, change.new_size)
+
+        self._measure("Apply", apply_changes)
+
+def print_help_and_exit():
+    print("Usage: discovery.py [--dry-run] [--jobs <n>]")
+    print()
+
+    print("Finds the functions in .text1 of main.dol and their sizes, and adds them to the symbol database.")
+    print("With --dry-run, the changes are only printed.")
+    print("With --jobs, the section is searched by that many processes, by default one per CPU.")
+    print()
+
+    sys.exit()
+
+def print_changes(changes):
+    rows = []
+
+    for change in changes:
+        old_size = util.hex24(change.old_size) if not change.is_new() else ""
+        rows.append(("Add" if change.is_new() else "Size", util.hex32(change.address), old_size, util.hex24(change.new_size)))
+
+    util.print_table(("Change", "Address", "Old size", "New size"), rows)
+
+def print_timings(timings):
+    rows = [(name, f"{seconds * 1000:.1f} ms") for name, seconds in timings]
+    rows.append(("Total", f"{sum(seconds for _, seconds in timings) * 1000:.1f} ms"))
+
+    util.print_table(("Phase", "Time"), rows)
+
+def main(args):
+    is_dry_run = False
+    jobs = os.cpu_count() or 1
+    i = 0
+
+    while i < len(args):
+        arg = args[i]
+
+        if arg == "--dry-run":
+            is_dry_run = True
+        elif arg == "--jobs" and i + 1 < len(args):
+            i += 1
+
+            try:
+                jobs = int(args[i])
+            except ValueError:
+                print_help_and_exit()
+        else:
+            print_help_and_exit()
+
+        i += 1
+
+    sym_db = db.SymbolDB()
+    sym_db.load()
+
+    cache = disasm_cache.DisasmCache()
+
+    with dol.Dol() as main_dol:
+        cache.load(disasm_cache.get_dol_hash(main_dol.data))
+
+        discovery = Discovery(main_dol, sym_db, jobs=jobs, cache=cache)
+        changes = discovery.run()
+
+    cache.save()
+
+    added = sum(1 for change in changes if change.is_new())
+
+    if is_dry_run:
+        print_changes(changes)
+        print()
+    else:
+        discovery.apply()
+        sym_db.save()
+
+    print(f"{added} new function(s), {len(changes) - added} size change(s)")
+    print()
+
+    print_timings(discovery.timings)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,160 @@
+import bisect
+import mmap
+import struct
+import util
+
+DOL_FILE_NAME = util.ROOT_PATH / "main.dol"
+
+TEXT_SECTION_COUNT = 7
+DATA_SECTION_COUNT = 11
+SECTION_COUNT = TEXT_SECTION_COUNT + DATA_SECTION_COUNT
+
+# The header has the file offsets, addresses and sizes of all sections, in
+# that order, followed by the .bss address and size and the entry point
+HEADER_OFFSETS = 0x00
+HEADER_ADDRESSES = 0x48
+HEADER_SIZES = 0x90
+HEADER_BSS = 0xD8
+
+def get_words(data, offset=0, count=None):
+    # The data as big endian 32 bit words, a zero copy NumPy array if NumPy
+    # is installed and a tuple otherwise. NumPy is imported here since it is
+    # slow to import and db.py only needs the header.
+    if count is None:
+        count = (len(data) - offset) // 4
+
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        return struct.unpack_from(f">{count}I", data, offset)
+
+    return numpy.frombuffer(data, dtype=">u4", count=count, offset=offset)
+
+class Section:
+    def __init__(self, name, offset, address, size):
+        self.name = name
+        self.offset = offset
+        self.address = address
+        self.size = size
+
+    @property
+    def end(self):
+        return self.address + self.size
+
+    def is_text(self):
+        return self.name.startswith(".text")
+
+class Dol:
+    # main.dol, memory mapped
+    def __init__(self, file_name=DOL_FILE_NAME):
+        self.file_name = file_name
+        self.file = None
+        self.data = None
+        self.sections = []
+        self.section_addresses = []
+        self.bss_address = 0
+        self.bss_size = 0
+        self.entry_point = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        self.file = open(self.file_name, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        offsets = struct.unpack_from(f">{SECTION_COUNT}I", self.data, HEADER_OFFSETS)
+        addresses = struct.unpack_from(f">{SECTION_COUNT}I", self.data, HEADER_ADDRESSES)
+        sizes = struct.unpack_from(f">{SECTION_COUNT}I", self.data, HEADER_SIZES)
+
+        self.bss_address, self.bss_size, self.entry_point = struct.unpack_from(">3I", self.data, HEADER_BSS)
+
+        self.sections = []
+
+        for i in range(SECTION_COUNT):
+            if sizes[i] == 0:
+                continue
+
+            if i < TEXT_SECTION_COUNT:
+                name = f".text{i}"
+            else:
+                name = f".data{i - TEXT_SECTION_COUNT}"
+
+            self.sections.append(Section(name, offsets[i], addresses[i], sizes[i]))
+
+        # Sorted by address for find_section
+        self.sections.sort(key=lambda section: section.address)
+        self.section_addresses = [section.address for section in self.sections]
+
+    def close(self):
+        if self.data is not None:
+            # Views may still be alive, the map is then unmapped once the
+            # last of them is gone
+            try:
+                self.data.close()
+            except BufferError:
+                pass
+
+            self.data = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def get_section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+
+        return None
+
+    def get_text_sections(self):
+        return [section for section in self.sections if section.is_text()]
+
+    def get_data_sections(self):
+        return [section for section in self.sections if not section.is_text()]
+
+    def find_section(self, address):
+        # Returns the section containing the address, or None if it isn't
+        # in the file, like addresses in .bss
+        index = bisect.bisect_right(self.section_addresses, address) - 1
+
+        if index < 0 or address >= self.sections[index].end:
+            return None
+
+        return self.sections[index]
+
+    def address_to_offset(self, address):
+        section = self.find_section(address)
+
+        if section is None:
+            return None
+
+        return section.offset + address - section.address
+
+    def offset_to_address(self, offset):
+        for section in self.sections:
+            if offset >= section.offset and offset < section.offset + section.size:
+                return section.address + offset - section.offset
+
+        return None
+
+    def read_u32(self, address):
+        data, = struct.unpack_from(">I", self.data, self.address_to_offset(address))
+        return data
+
+    def get_view(self, section):
+        # Zero copy view of the bytes of the section
+        return memoryview(self.data)[section.offset:section.offset + section.size]
+
+    def read_words(self, section):
+        # The section decoded once into a tuple of big endian 32 bit words,
+        # which is much faster to index from Python than a NumPy array
+        return struct.unpack_from(f">{section.size // 4}I", self.data, section.offset)
+
+    def get_words(self, section):
+        return get_words(self.data, section.offset, section.size // 4)
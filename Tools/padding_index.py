@@ -0,0 +1,58 @@
+import bisect
+
+try:
+    import numpy
+    _USE_NUMPY = True
+except ModuleNotFoundError:
+    _USE_NUMPY = False
+
+class PaddingIndex:
+    # The runs of zero words in a section, as sorted start and end addresses.
+    # Functions are padded with zeros, so the next run after an address bounds
+    # the size of the function there.
+    def __init__(self, words, address):
+        self.address = address
+        self.end = address + len(words) * 4
+        self.starts = []
+        self.ends = []
+
+        if _USE_NUMPY:
+            self._build_numpy(words)
+        else:
+            self._build(words)
+
+    def _build_numpy(self, words):
+        is_zero = numpy.concatenate(([False], numpy.asarray(words) == 0, [False]))
+        changes = numpy.flatnonzero(is_zero[1:] != is_zero[:-1])
+
+        # Changes alternate between the start and the end of a run
+        self.starts = (self.address + changes[0::2] * 4).tolist()
+        self.ends = (self.address + changes[1::2] * 4).tolist()
+
+    def _build(self, words):
+        start = None
+
+        for i, word in enumerate(words):
+            if word == 0 and start is None:
+                start = i
+            elif word != 0 and start is not None:
+                self.starts.append(self.address + start * 4)
+                self.ends.append(self.address + i * 4)
+                start = None
+
+        if start is not None:
+            self.starts.append(self.address + start * 4)
+            self.ends.append(self.end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_next_padding(self, address):
+        # Returns the address of the first zero word at or after the address,
+        # or the end of the section if there is none
+        index = bisect.bisect_right(self.ends, address)
+
+        if index == len(self.starts):
+            return self.end
+
+        return max(address, self.starts[index])
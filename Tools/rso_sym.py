@@ -1,3 +1,4 @@
+import dol
 import struct
 import util
 
@@ -12,6 +13,16 @@ SECTION_TO_ADDRESS = {
     11: 0x8061EA80, # .uninitialized1 (.sbss)
 }
 
+# The sections above that are in main.dol. Their addresses are read from it
+# when it exists, .bss isn't split up in the DOL header so it stays as is.
+SECTION_TO_DOL_SECTION = {
+    1: ".text0",
+    2: ".text1",
+    5: ".data4",
+    6: ".data5",
+    9: ".data7"
+}
+
 SECTIONS_TO_IGNORE = {
     65521
 }
@@ -20,6 +31,19 @@ def get_u32(data, offset):
     data, = struct.unpack_from(">I", data, offset)
     return data
 
+def get_section_addresses():
+    section_addresses = dict(SECTION_TO_ADDRESS)
+
+    if dol.DOL_FILE_NAME.exists():
+        with dol.Dol() as main_dol:
+            for section_index, name in SECTION_TO_DOL_SECTION.items():
+                section = main_dol.get_section(name)
+
+                if section is not None:
+                    section_addresses[section_index] = section.address
+
+    return section_addresses
+
 def read_nt_string(data: bytes, offset: int):
     end = data.find(b'\x00', offset)
 
@@ -31,6 +55,8 @@ def read_nt_string(data: bytes, offset: int):
 def main():
     RSO_PATH = "Y:\\Wii\\Donkey Kong Country Returns\\v1.1 USA\\Data\\files\\RSO\\wii_production\\selfile.sel"
     
+    section_addresses = get_section_addresses()
+
     with open(RSO_PATH, "rb") as input:
         rso_data = input.read()
 
@@ -52,11 +78,11 @@ def main():
             if section_index in SECTIONS_TO_IGNORE:
                 continue
 
-            if not section_index in SECTION_TO_ADDRESS:
+            if not section_index in section_addresses:
                 print(f"Invalid section index: {section_index}")
                 return
 
-            section_address = SECTION_TO_ADDRESS[section_index]
+            section_address = section_addresses[section_index]
             address = section_address + sym_offset
 
             lines.append(f"{util.hex32(address)} {util.hex32(section_index)} {sym_name}")
@@ -0,0 +1,346 @@
+import os
+import pickle
+import re
+from array import array
+
+# Bump when the layout of the index file changes
+INDEX_VERSION = 1
+
+FIELDS = { "lib", "obj", "section", "type", "decompiled" }
+
+REGEX_SPECIAL = set(".^$*+?{}[]()|\\")
+REGEX_QUANTIFIERS = set("*?{")
+
+# Number of characters after escapes like \x43 that belong to the escape
+REGEX_ESCAPE_ARGUMENTS = { "x": 2, "u": 4, "U": 8 }
+
+# Terms are separated by spaces, except inside double quotes
+TERM_PATTERN = re.compile(r'(?:"[^"]*"|[^\s"])+')
+
+class Query:
+    def __init__(self):
+        self.terms = []
+        self.regex = None
+        self.fields = dict()
+
+def parse_query(query):
+    # Terms are separated by spaces, and double quotes keep spaces in a term,
+    # e.g. re:"\(void\) const$". A term is either a field filter such as
+    # lib:gx, a regex written as re:<regex> or /<regex>/, or a substring.
+    # Raises re.error for an invalid regex.
+    result = Query()
+
+    for term in TERM_PATTERN.findall(query):
+        term = term.replace("\"", "")
+
+        if term.startswith("re:") and len(term) > 3:
+            result.regex = term[3:]
+        elif len(term) > 2 and term.startswith("/") and term.endswith("/"):
+            result.regex = term[1:-1]
+        elif ":" in term and term.split(":", 1)[0].lower() in FIELDS:
+            field, value = term.split(":", 1)
+            result.fields[field.lower()] = value
+        else:
+            result.terms.append(term.lower())
+
+    if result.regex is not None:
+        re.compile(result.regex)
+
+    return result
+
+def get_escape_end(regex, i):
+    # Returns the end of the escape at regex[i], including the arguments of
+    # escapes like \x43, \u0043, \N{...} and octal escapes
+    c = regex[i + 1] if i + 1 < len(regex) else ""
+    end = i + 2
+
+    if c in REGEX_ESCAPE_ARGUMENTS:
+        end += REGEX_ESCAPE_ARGUMENTS[c]
+    elif c == "N" and end < len(regex) and regex[end] == "{":
+        closing = regex.find("}", end)
+        end = closing + 1 if closing != -1 else len(regex)
+    elif c.isdigit():
+        while end < len(regex) and end < i + 4 and regex[end].isdigit():
+            end += 1
+
+    return min(end, len(regex))
+
+def get_search_texts(texts):
+    # Searches are case insensitive
+    return [text.lower() for text in texts if text]
+
+def get_trigrams(text):
+    return { text[i:i + 3] for i in range(len(text) - 2) }
+
+def get_regex_literals(regex):
+    # Returns substrings every match of the regex must contain. This is
+    # conservative: alternations give nothing and groups are skipped.
+    if "|" in regex:
+        return []
+
+    literals = []
+    current = ""
+    i = 0
+
+    while i < len(regex):
+        c = regex[i]
+
+        if c == "\\":
+            if i + 1 < len(regex) and not regex[i + 1].isalnum():
+                current += regex[i + 1]
+                i += 2
+                continue
+
+            # Classes like \d and escaped characters like \x43 break the literal
+            literals.append(current)
+            current = ""
+            i = get_escape_end(regex, i)
+        elif c == "[" or c == "(":
+            closing = "]" if c == "[" else ")"
+            depth = 0
+
+            while i < len(regex):
+                if regex[i] == "\\":
+                    i += 1
+                elif regex[i] == c:
+                    depth += 1
+                elif regex[i] == closing:
+                    depth -= 1
+
+                    if depth == 0:
+                        break
+
+                i += 1
+
+            literals.append(current)
+            current = ""
+            i += 1
+        elif c in REGEX_QUANTIFIERS or c == "+":
+            # The quantified character may be missing (or, for +, repeated)
+            if c != "+":
+                current = current[:-1]
+
+            literals.append(current)
+            current = ""
+
+            if c == "{":
+                while i < len(regex) and regex[i] != "}":
+                    i += 1
+
+            i += 1
+        elif c in REGEX_SPECIAL:
+            literals.append(current)
+            current = ""
+            i += 1
+        else:
+            current += c
+            i += 1
+
+    literals.append(current)
+
+    return [literal.lower() for literal in literals if literal]
+
+class SearchIndex:
+    # Trigram index over the lowercase searchable texts of each symbol. The
+    # addresses of each trigram are a set, or the bytes of an array("I") for
+    # an index loaded from a file until the trigram is used.
+    def __init__(self):
+        self.texts = dict()
+        self.trigrams = dict()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def load(self, file_name, key):
+        # Returns False if the file is missing or was written for another key
+        try:
+            with open(file_name, "rb") as input:
+                index = pickle.load(input)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+
+        if not isinstance(index, dict) or index.get("version") != INDEX_VERSION or index["key"] != key:
+            return False
+
+        self.texts = index["texts"]
+        self.trigrams = index["trigrams"]
+
+        return True
+
+    def save(self, file_name, key):
+        trigrams = dict()
+
+        for trigram, addresses in self.trigrams.items():
+            if isinstance(addresses, set):
+                addresses = array("I", sorted(addresses)).tobytes()
+
+            trigrams[trigram] = addresses
+
+        index = {
+            "version": INDEX_VERSION,
+            "key": key,
+            "texts": self.texts,
+            "trigrams": trigrams
+        }
+
+        temp_file_name = file_name.with_name(file_name.name + ".tmp")
+
+        try:
+            with open(temp_file_name, "wb") as output:
+                pickle.dump(index, output, pickle.HIGHEST_PROTOCOL)
+
+            os.replace(temp_file_name, file_name)
+        except OSError:
+            pass
+
+    def _get_addresses(self, trigram):
+        addresses = self.trigrams.get(trigram)
+
+        if isinstance(addresses, bytes):
+            packed = array("I")
+            packed.frombytes(addresses)
+
+            addresses = set(packed)
+            self.trigrams[trigram] = addresses
+
+        return addresses
+
+    def add(self, address, texts):
+        texts = get_search_texts(texts)
+
+        if len(texts) == 0:
+            return
+
+        self.texts[address] = texts
+
+        for trigram in get_trigrams("\n".join(texts)):
+            addresses = self._get_addresses(trigram)
+
+            if addresses is None:
+                self.trigrams[trigram] = { address }
+            else:
+                addresses.add(address)
+
+    def remove(self, address):
+        texts = self.texts.pop(address, None)
+
+        if texts is None:
+            return
+
+        for trigram in get_trigrams("\n".join(texts)):
+            addresses = self._get_addresses(trigram)
+            addresses.discard(address)
+
+            if len(addresses) == 0:
+                del self.trigrams[trigram]
+
+    def get_candidates(self, literals):
+        # Returns the addresses containing every trigram of every literal, or
+        # None when the literals are too short to narrow down the search
+        candidates = None
+
+        for literal in literals:
+            for trigram in get_trigrams(literal):
+                addresses = self._get_addresses(trigram)
+
+                if addresses is None:
+                    return set()
+
+                if candidates is None:
+                    candidates = set(addresses)
+                else:
+                    candidates &= addresses
+
+                if len(candidates) == 0:
+                    return candidates
+
+        return candidates
+
+    def search(self, query, candidates=None, limit=None):
+        literals = list(query.terms)
+
+        if query.regex is not None:
+            literals.extend(get_regex_literals(query.regex))
+
+        trigram_candidates = self.get_candidates(literals)
+
+        if trigram_candidates is not None:
+            candidates = trigram_candidates if candidates is None else candidates & trigram_candidates
+
+        if candidates is None:
+            candidates = self.texts.keys()
+
+        items = ((address, self.texts.get(address)) for address in candidates)
+
+        return search_texts(query, items, limit)
+
+def search_texts(query, items, limit=None):
+    # Returns the addresses of the (address, texts) items that match, best
+    # matches first. Exact matches rank above prefix matches, which rank
+    # above other matches, then earlier and shorter matches win. The texts
+    # have to be lowercase.
+    regex = None
+
+    if query.regex is not None:
+        regex = re.compile(query.regex, re.IGNORECASE)
+
+    results = []
+
+    for address, texts in items:
+        if texts is None:
+            continue
+
+        score = get_score(texts, query.terms, regex)
+
+        if score is not None:
+            results.append((score, address))
+
+    results.sort()
+
+    if limit is not None:
+        results = results[:limit]
+
+    return [address for _, address in results]
+
+def get_score(texts, terms, regex):
+    best = None
+
+    for text in texts:
+        kind = 2
+        position = 0
+        matches = True
+
+        for term in terms:
+            index = text.find(term)
+
+            if index == -1:
+                matches = False
+                break
+
+            if text == term:
+                kind = min(kind, 0)
+            elif index == 0:
+                kind = min(kind, 1)
+
+            position = max(position, index)
+
+        if not matches:
+            continue
+
+        if regex is not None:
+            match = regex.search(text)
+
+            if match is None:
+                continue
+
+            if match.start() == 0:
+                kind = min(kind, 0 if match.end() == len(text) else 1)
+
+            position = max(position, match.start())
+
+        score = (kind, position, len(text))
+
+        if best is None or score < best:
+            best = score
+
+    return best